@@ -1,17 +1,44 @@
 import streamlit as st
 import google.oauth2.credentials
+import google.auth.transport.requests
 import googleapiclient.discovery
+import googleapiclient.discovery_cache
+import googleapiclient.errors
 import requests
+import httpx
+import asyncio
 from urllib.parse import urlencode
 import pandas as pd
-import base64
+import pyarrow as pa
+import pyarrow.compute as pc
+import binascii
 import datetime
+import email.utils
+import html
 import time
 import re
 import plotly.express as px
 import numpy as np
 import os
+import json
+import zlib
+import glob
+import sqlite3
+import hashlib
+import collections
+import random
+import contextlib
+import threading
+import functools
+import itertools
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import plotly.graph_objects as go
+import shutil
+import tempfile
+
+import htmltext
+import takeout
 
 # Google OAuth Configuration
 CLIENT_ID = st.secrets["google"]["client_id"]
@@ -38,6 +65,7 @@ COUNTRIES = {
             "iphone": 450000,
         },
         "fuel": {"km_per_liter": 15, "route_name": "Karachi to Islamabad", "route_km": 1400},
+        "timezone": "Asia/Karachi",
     },
     "Bangladesh": {
         "sender": "info@mail.foodpanda.com.bd",
@@ -54,6 +82,7 @@ COUNTRIES = {
             "iphone": 165000,
         },
         "fuel": {"km_per_liter": 15, "route_name": "Dhaka to Cox's Bazar", "route_km": 415},
+        "timezone": "Asia/Dhaka",
     },
 }
 
@@ -88,35 +117,135 @@ def exchange_code_for_tokens(auth_code):
         raise Exception(f"Failed to exchange code: {response.text}")
     return response.json()
 
-def _extract_text_body(payload):
-    """Walk Gmail's message payload tree to find text/plain (preferred) or text/html.
+@st.cache_resource(show_spinner=False)
+def _gmail_discovery_document():
+    """Gmail's discovery document, read once for the whole process.
+
+    Kept as text: build_from_document mutates the dict it is given, while a
+    string is immutable and safe to share across sessions and threads. Parsing
+    it per build is cheaper than deep-copying a parsed one.
+    """
+    return googleapiclient.discovery_cache.get_static_doc("gmail", "v1")
+
+def build_gmail_service(credentials):
+    """A Gmail service of its own for `credentials`, built from the shared discovery document.
 
-    The previous implementation took parts[0].body.data blindly, which crashes on
-    promos with embedded images, multipart/related shells, or simple emails with
-    no `parts` key. Walking the tree is robust against all those cases.
+    Services wrap an httplib2 transport, which isn't thread-safe, so each
+    session and each worker thread needs its own.
     """
-    plain_b64 = None
-    html_b64 = None
+    return googleapiclient.discovery.build_from_document(_gmail_discovery_document(), credentials=credentials)
+
+def _credentials_key(refresh_token, token):
+    """Key identifying a credential that never holds the token itself."""
+    return hashlib.sha256((refresh_token or token).encode("utf-8")).hexdigest()
 
-    def walk(node):
-        nonlocal plain_b64, html_b64
-        mime = node.get("mimeType", "")
+def forget_gmail_service():
+    """Drop this session's Gmail service, and the credentials it holds."""
+    st.session_state.pop("gmail_service", None)
+
+def get_gmail_service(credentials):
+    """Return this session's Gmail service for `credentials`, refreshing its token if it has expired.
+
+    The service lives in session state, so its keep-alive connections are
+    reused by every later analysis in the session, but never shared with
+    another session's script thread. A refreshed token is written back to
+    session state so the async engine, which reads the token directly, uses it too.
+    """
+    credentials_key = _credentials_key(credentials.refresh_token, credentials.token)
+    cached = st.session_state.get("gmail_service")
+    if cached is None or cached[0] != credentials_key:
+        cached = credentials_key, build_gmail_service(credentials), credentials
+        st.session_state["gmail_service"] = cached
+    _, service, cached_credentials = cached
+    if cached_credentials.expired and cached_credentials.refresh_token:
+        cached_credentials.refresh(google.auth.transport.requests.Request())
+    # Worker services are built from this run's `credentials`; hand them the live
+    # token so they don't each refresh it on their own threads.
+    credentials.token, credentials.expiry = cached_credentials.token, cached_credentials.expiry
+    session_credentials = st.session_state.get("credentials")
+    if session_credentials and session_credentials.get("token") != cached_credentials.token:
+        session_credentials["token"] = cached_credentials.token
+        session_credentials["expiry"] = cached_credentials.expiry
+    return service
+
+def _text_body_data(payload):
+    """(data, mime type) of the first text/plain part, else the first text/html part, or (None, None).
+
+    Walks Gmail's payload tree iteratively in document order and stops at the
+    first text/plain part. Taking parts[0].body.data blindly crashes on promos
+    with embedded images, multipart/related shells, or simple emails with no
+    `parts` key; walking the tree is robust against all those cases.
+    """
+    html_part = (None, None)
+    stack = [payload]
+    while stack:
+        node = stack.pop()
         data = (node.get("body") or {}).get("data")
-        if mime == "text/plain" and data and plain_b64 is None:
-            plain_b64 = data
-        elif mime == "text/html" and data and html_b64 is None:
-            html_b64 = data
-        for child in node.get("parts") or []:
-            walk(child)
-
-    walk(payload)
-    chosen = plain_b64 or html_b64
-    if not chosen:
-        return ""
+        if data:
+            mime = node.get("mimeType", "")
+            if mime == "text/plain":
+                return data, mime
+            if mime == "text/html" and html_part[0] is None:
+                html_part = data, mime
+        parts = node.get("parts")
+        if parts:
+            stack.extend(reversed(parts))
+    return html_part
+
+
+_URLSAFE_TO_STANDARD = bytes.maketrans(b"-_", b"+/")
+# Receipt totals and restaurant names sit near the top of the body; the rest
+# of a big HTML receipt is footer, legal text and styling.
+BODY_PREFIX_BYTES = 32 * 1024
+
+
+def _base64url_bytes(data):
+    """Decode Gmail's base64url `data`, padded or not, to bytes."""
+    standard = data.encode("ascii").translate(_URLSAFE_TO_STANDARD)
+    if len(standard) % 4:
+        standard += b"=" * (-len(standard) % 4)
+    return binascii.a2b_base64(standard)
+
+
+def _decode_base64url(data, max_bytes=None, boundary=b"\n"):
+    """Decode Gmail's base64url body `data` to text, returning (text, truncated).
+
+    With `max_bytes`, only whole base64 quanta covering the first `max_bytes`
+    bytes are decoded and the text is cut back to the last `boundary`, so the
+    parser never sees half an amount; `truncated` says whether any of the body
+    was left undecoded.
+    """
+    truncated = max_bytes is not None and len(data) * 3 // 4 > max_bytes
+    if truncated:
+        data = data[:-(-max_bytes // 3) * 4]
+    raw = _base64url_bytes(data)
+    if truncated:
+        raw = memoryview(raw)[:raw.rfind(boundary) + 1]
+    return str(raw, "utf-8", "replace"), truncated
+
+
+def _decode_text_body(payload, max_bytes=None):
+    """(text, truncated) for the payload's text body; see _decode_base64url.
+
+    HTML-only bodies come back as htmltext.html_to_text output, so the parsers
+    never scan markup.
+    """
+    data, mime = _text_body_data(payload)
+    if not data:
+        return "", False
     try:
-        return base64.urlsafe_b64decode(chosen).decode("utf-8", errors="replace")
+        if mime != "text/html":
+            return _decode_base64url(data, max_bytes)
+        # Markup often has no newlines at all; a prefix ends before the last tag instead.
+        markup, truncated = _decode_base64url(data, max_bytes, boundary=b"<")
+        return htmltext.html_to_text(markup), truncated
     except Exception:
-        return ""
+        return "", False
+
+
+def _extract_text_body(payload):
+    """The payload's whole text/plain body, else its text/html body as text."""
+    return _decode_text_body(payload)[0]
 
 
 _FORWARD_MARKERS = (
@@ -124,78 +253,974 @@ _FORWARD_MARKERS = (
     "---------- Forwarded message ----------",
     "Begin forwarded message:",
 )
+_NUMBER = re.compile(r'([\d,]+\.?\d*)')
+
+
+def _price_from_line(text):
+    """The whole rest of the line as an amount ("1,234.50"), or 0."""
+    try:
+        return float(text.strip().replace(',', ''))
+    except ValueError:
+        return 0
+
+
+def _first_number_in_line(text):
+    """The first amount on the line, ignoring anything around it, or 0."""
+    match = _NUMBER.search(text)
+    return float(match.group(1).replace(',', '')) if match else 0
+
 
+def _after_first(marker, currency):
+    """Regex for `marker`, then `currency` before the next `marker`, capturing the rest of that line."""
+    marker, currency = re.escape(marker), re.escape(currency)
+    return rf"{marker}(?:(?!{marker})[\s\S])*?{currency}([^\n]*)"
 
-def _strip_forward_wrapper(body):
-    """If body is a forwarded email, return only the original quoted content."""
+
+def _quoted_start(body):
+    """Offset of the original email inside a forwarded one (0 if it isn't a forward)."""
+    # Every marker contains this, so ordinary receipts cost a single scan.
+    if "orwarded message" not in body:
+        return 0
     for marker in _FORWARD_MARKERS:
         idx = body.find(marker)
         if idx != -1:
-            return body[idx + len(marker):]
-    return body
+            return idx + len(marker)
+    return 0
+
+
+class ReceiptParser:
+    """Extracts (price, restaurant) from one country's order email body.
+
+    Each field is one precompiled pattern that starts with a literal, so re's
+    fast prefix search finds it, and every search starts at the end of any
+    forward marker instead of on a sliced copy of the body. Nothing is split
+    into lists and no exceptions drive the fallbacks: the fallback total is
+    only searched for when there is no total, and the restaurant defaults to
+    `default_restaurant`.
+    """
+
+    def __init__(self, total, restaurant, price, fallback_total=None, default_restaurant="Panda Mart"):
+        self.total = re.compile(total)
+        self.fallback_total = re.compile(fallback_total) if fallback_total else None
+        self.restaurant = re.compile(restaurant)
+        self.price = price
+        self.default_restaurant = default_restaurant
+
+    def parse(self, body):
+        start = _quoted_start(body)
+        match = self.total.search(body, start)
+        if match is None and self.fallback_total is not None:
+            match = self.fallback_total.search(body, start)
+        price = self.price(match.group(1)) if match else 0
+        match = self.restaurant.search(body, start)
+        restaurant = match.group(1).strip() if match else self.default_restaurant
+        return price, restaurant
+
+    def parse_many(self, bodies):
+        """Vectorized parse: a DataFrame with float64 `price` and string `restaurant`, one row per body.
+
+        Same results as calling parse on each body, using pandas str methods
+        on the whole column instead of a Python loop. On CPython str.extract
+        still runs re once per element, so this is slower than parse in a loop;
+        the ingestion paths, which see bodies one at a time anyway, use parse.
+        """
+        bodies = pd.Series(bodies, dtype=object).reset_index(drop=True).fillna("")
+        quoted = bodies.copy()
+        pending = bodies.str.contains("orwarded message", regex=False)
+        for marker in _FORWARD_MARKERS:
+            forwarded = pending & bodies.str.contains(marker, regex=False)
+            quoted[forwarded] = bodies[forwarded].str.split(marker, n=1, regex=False).str[1]
+            pending &= ~forwarded
+
+        lines = quoted.str.extract(self.total, expand=False)
+        missing = lines.isna()
+        if self.fallback_total is not None and missing.any():
+            lines[missing] = quoted[missing].str.extract(self.fallback_total, expand=False)
+        restaurants = quoted.str.extract(self.restaurant, expand=False).str.strip()
+        return pd.DataFrame({
+            "price": lines.map(self.price, na_action="ignore").fillna(0.0).astype("float64"),
+            "restaurant": restaurants.fillna(self.default_restaurant).astype("string"),
+        })
+
+
+# One parser per COUNTRIES entry; bump PARSER_VERSIONS when changing one.
+RECEIPT_PARSERS = {
+    # "Total PKR 1,234.00" (older receipts: "Received Rs. 1,234") and "Partner: Name: <restaurant>"
+    "Pakistan": ReceiptParser(
+        total=_after_first("Total", "PKR"),
+        fallback_total=_after_first("Received", "Rs."),
+        restaurant=r"Partner:\s*Name:\s*(.+)",
+        price=_price_from_line,
+    ),
+    # "Order Total Tk 571.90" and "Store <restaurant name>"
+    "Bangladesh": ReceiptParser(
+        total=_after_first("Order Total", "Tk"),
+        restaurant=r"Store\s+([^\n<]+)",
+        price=_first_number_in_line,
+    ),
+}
 
 
 def parse_order_email(decoded_content, country):
     """Extract (price, restaurant) from a Foodpanda order email body for the given country."""
-    decoded_content = _strip_forward_wrapper(decoded_content)
-    if country == "Bangladesh":
-        # BD format: "Order Total Tk 571.90" and "Store <restaurant name>"
+    return RECEIPT_PARSERS.get(country, RECEIPT_PARSERS["Pakistan"]).parse(decoded_content)
+
+
+def parse_order_emails(bodies, country):
+    """Batch parse_order_email: a price/restaurant DataFrame for a list or Series of bodies."""
+    return RECEIPT_PARSERS.get(country, RECEIPT_PARSERS["Pakistan"]).parse_many(bodies)
+
+
+def _message_date_and_body(msg_details, max_bytes=None):
+    """Pull the order date and decoded text body out of a messages.get response.
+
+    The date is Gmail's internalDate (epoch milliseconds), falling back to the
+    Date header string; see order_timestamps. With `max_bytes` only a prefix of
+    the body is decoded; the third value says whether the rest was skipped.
+    format=raw responses (the "raw" transport) are parsed whole with the stdlib
+    email package instead.
+    """
+    if "raw" in msg_details:
+        date, decoded_content = takeout.message_date_and_body(_base64url_bytes(msg_details["raw"]))
+        if msg_details.get("internalDate"):
+            date = int(msg_details["internalDate"])
+        return date, decoded_content, False
+    if msg_details.get("internalDate"):
+        date = int(msg_details["internalDate"])
+    else:
+        headers = msg_details["payload"]["headers"]
+        date = next((h["value"] for h in headers if h["name"] == "Date"), "No Date")
+    return (date, *_decode_text_body(msg_details["payload"], max_bytes))
+
+
+def _parse_decoded(msg_details, date, decoded_content, truncated, country):
+    """Parse a possibly truncated body, decoding the rest only when the prefix wasn't enough.
+
+    Returns (decoded_content, order). A prefix counts as enough once it yields a
+    receipt with an explicit restaurant, since a missing restaurant or total may
+    simply lie further down.
+    """
+    order = _parse_body(date, decoded_content, country)
+    if truncated:
+        default = RECEIPT_PARSERS.get(country, RECEIPT_PARSERS["Pakistan"]).default_restaurant
+        if order is None or order[2] == default:
+            _, decoded_content, _ = _message_date_and_body(msg_details)
+            order = _parse_body(date, decoded_content, country)
+    return decoded_content, order
+
+
+def _body_prefix_bytes(cache):
+    """How much of each body to decode up front; a cache that keeps bodies needs them whole."""
+    return None if cache is not None and cache.store_bodies else BODY_PREFIX_BYTES
+
+
+def _parse_message(msg_details, country):
+    """Turn a messages.get response into (date, price, restaurant), or None if it isn't a receipt."""
+    date, decoded_content, truncated = _message_date_and_body(msg_details, BODY_PREFIX_BYTES)
+    return _parse_decoded(msg_details, date, decoded_content, truncated, country)[1]
+
+
+def _parse_body(date, decoded_content, country):
+    """Build the (date, price, restaurant) order for a decoded body, or None if it isn't a receipt."""
+    if not decoded_content:
+        return None
+
+    price, restaurant = parse_order_email(decoded_content, country)
+
+    # Skip non-receipt emails (promos, status updates) where the
+    # parser couldn't find an order total.
+    if price == 0:
+        return None
+    return date, price, restaurant
+
+
+# Bump a country's version whenever its parse_order_email branch changes.
+# Cached results stamped with an older version are re-parsed from the stored
+# body, or re-downloaded when no body was kept; other countries stay cached.
+PARSER_VERSIONS = {
+    "Pakistan": 2,
+    "Bangladesh": 2,
+}
+MESSAGE_CACHE_MAX_ENTRIES = 50_000
+# Returned by MessageCache.get for IDs it has no usable entry for.
+CACHE_MISS = object()
+
+
+class MessageCache:
+    """LRU cache of parsed receipts keyed by (account, Gmail message ID).
+
+    A message never changes once delivered, so its parse result (including
+    "not a receipt") can be reused on every later analysis. Entries live in
+    SQLite: in memory by default, or in a file for self-hosted installs. With
+    `store_bodies` the decoded body is kept zlib-compressed so a parser version
+    bump can re-parse without touching Gmail.
+    """
+
+    def __init__(self, path=":memory:", max_entries=MESSAGE_CACHE_MAX_ENTRIES, store_bodies=False):
+        self.max_entries = max_entries
+        self.store_bodies = store_bodies
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                account TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                country TEXT NOT NULL,
+                parser_version INTEGER NOT NULL,
+                date,
+                price REAL,
+                restaurant TEXT,
+                body BLOB,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (account, message_id, country)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_last_used ON messages (last_used)")
+        self._size = self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def get(self, account, message_id, country):
+        """Return the cached order, None for a known non-receipt, or CACHE_MISS."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT parser_version, date, price, restaurant, body FROM messages "
+                "WHERE account = ? AND message_id = ? AND country = ?",
+                (account, message_id, country),
+            ).fetchone()
+            if row is None:
+                return CACHE_MISS
+            version, date, price, restaurant, body = row
+            # Caches created with a TEXT date column hand internalDate epochs back as strings.
+            if isinstance(date, str) and date.isdigit():
+                date = int(date)
+            if version == PARSER_VERSIONS[country]:
+                # Only the LRU timestamp changes; leave the stored body alone.
+                self._conn.execute(
+                    "UPDATE messages SET last_used = ? WHERE account = ? AND message_id = ? AND country = ?",
+                    (time.time_ns(), account, message_id, country),
+                )
+                return None if price is None else (date, price, restaurant)
+            if body is None:
+                return CACHE_MISS
+            decoded_content = zlib.decompress(body).decode("utf-8")
+            # Bodies cached before HTML-only receipts were converted to text.
+            if htmltext.looks_like_html(decoded_content):
+                decoded_content = htmltext.html_to_text(decoded_content)
+            order = _parse_body(date, decoded_content, country)
+            self._write(account, message_id, country, date, order, body)
+            return order
+
+    def put(self, account, message_id, country, date, decoded_content, order):
+        """Remember the parse result (`order` may be None) for a downloaded message."""
+        body = zlib.compress(decoded_content.encode("utf-8")) if self.store_bodies and decoded_content else None
+        with self._lock:
+            is_new = self._conn.execute(
+                "SELECT 1 FROM messages WHERE account = ? AND message_id = ? AND country = ?",
+                (account, message_id, country),
+            ).fetchone() is None
+            self._write(account, message_id, country, date, order, body)
+            if is_new:
+                self._size += 1
+                self._evict()
+
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+
+    def _write(self, account, message_id, country, date, order, body):
+        price, restaurant = (order[1], order[2]) if order else (None, None)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (account, message_id, country, PARSER_VERSIONS[country], date, price, restaurant, body, time.time_ns()),
+        )
+
+    def _evict(self):
+        excess = self._size - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM messages WHERE rowid IN (SELECT rowid FROM messages ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self._size -= excess
+
+
+@st.cache_resource
+def get_message_cache():
+    """Process-wide message cache, or None unless FOODPANDA_CACHE_PATH names a file to keep it in.
+
+    The cache outlives sessions and holds every user's parsed orders, so only
+    self-hosted installs that opt in get one.
+    """
+    path = os.environ.get("FOODPANDA_CACHE_PATH")
+    return MessageCache(path, store_bodies=path != ":memory:") if path else None
+
+
+# How far apart a CSV row's date and a fetched order's can be for OrderDatabase.import_csv to treat them as one.
+CSV_MATCH_WINDOW = pd.Timedelta(minutes=10)
+
+
+class OrderDatabase:
+    """Durable order history in SQLite, one row per (account, Gmail message ID).
+
+    Upserts are idempotent, so re-running an analysis never duplicates orders
+    and a re-parse simply overwrites the row. Dates are stored as UTC epoch
+    milliseconds. Indexes on date and restaurant let monthly_totals and
+    restaurant_totals aggregate in SQL instead of loading the whole history
+    into pandas. The Gmail history cursor each account and country last synced
+    to is kept alongside, so a later session can pick up where it left off.
+    """
+
+    def __init__(self, path=":memory:"):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS orders (
+                account TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                country TEXT NOT NULL,
+                date INTEGER NOT NULL,
+                price REAL NOT NULL,
+                restaurant TEXT NOT NULL,
+                PRIMARY KEY (account, message_id)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS orders_date ON orders (account, country, date)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS orders_restaurant ON orders (account, country, restaurant)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_cursors (
+                account TEXT NOT NULL,
+                country TEXT NOT NULL,
+                history_id TEXT NOT NULL,
+                PRIMARY KEY (account, country)
+            )
+        """)
+        self._conn.commit()
+
+    def upsert(self, account, country, message_ids, data_dict):
+        """Insert or update the orders in `data_dict`, keyed by the parallel `message_ids`; returns rows written.
+
+        Orders whose date can't be parsed are skipped.
+        """
+        timestamps = order_timestamps(data_dict['date'])
+        rows = [
+            (account, message_id, country, timestamp.value // 1_000_000, float(price), restaurant)
+            for message_id, timestamp, price, restaurant in zip(
+                message_ids, timestamps, data_dict['price'], data_dict['restaurant']
+            )
+            if timestamp is not pd.NaT
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (account, message_id) DO UPDATE SET "
+                "country = excluded.country, date = excluded.date, price = excluded.price, "
+                "restaurant = excluded.restaurant",
+                rows,
+            )
+        return len(rows)
+
+    def import_csv(self, csv_path, account, country):
+        """Migrate a save_to_csv file into the database for `account`; returns rows written.
+
+        CSV rows have no message ID, so each gets a stable key derived from its
+        contents (and how many identical rows came before it), which keeps
+        importing the same file twice idempotent. Rows that match an order
+        already fetched from Gmail (same restaurant and price, dated within
+        CSV_MATCH_WINDOW) are left out so it isn't counted twice.
+        """
+        df = pd.read_csv(csv_path)
+        seen = collections.Counter()
+        message_ids = []
+        for row in zip(df['date'].astype(str), df['price'].astype(str), df['restaurant'].astype(str)):
+            seen[row] += 1
+            digest = hashlib.sha256("\x1f".join((*row, str(seen[row]))).encode("utf-8")).hexdigest()[:32]
+            message_ids.append(f"csv:{digest}")
+        df['message_id'] = message_ids
+        df = df[~self._fetched_elsewhere(account, country, df)]
+        return self.upsert(account, country, df['message_id'].tolist(), df)
+
+    def _fetched_elsewhere(self, account, country, df):
+        """Boolean mask of `df` rows that match an order stored under a Gmail message ID."""
+        fetched = self._query(
+            "SELECT date, price, restaurant FROM orders WHERE account = ? AND country = ? "
+            "AND message_id NOT LIKE 'csv:%'",
+            (account, country), ['fetched_date', 'price', 'restaurant'],
+        )
+        # Older CSVs hold Date header strings, which can be a few seconds off Gmail's internalDate.
+        rows = df[['price', 'restaurant']].assign(row=range(len(df)), date=order_timestamps(df['date']).array)
+        candidates = rows.merge(fetched, on=['price', 'restaurant'])
+        fetched_dates = pd.to_datetime(candidates['fetched_date'], unit='ms', utc=True)
+        matched = candidates.loc[(candidates['date'] - fetched_dates).abs() <= CSV_MATCH_WINDOW, 'row']
+        return pd.Series(range(len(df)), index=df.index).isin(matched)
+
+    def has_csv_orders(self, account, country):
+        """Whether a CSV has already been imported for `account` in `country`."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM orders WHERE account = ? AND country = ? AND message_id LIKE 'csv:%' LIMIT 1",
+                (account, country),
+            ).fetchone() is not None
+
+    def save_cursor(self, account, country, history_id):
+        """Record the historyId every stored order for `account` in `country` is complete up to."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_cursors VALUES (?, ?, ?) ON CONFLICT (account, country) DO UPDATE SET "
+                "history_id = excluded.history_id",
+                (account, country, str(history_id)),
+            )
+
+    def cursor(self, account, country):
+        """The historyId saved by save_cursor, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history_id FROM sync_cursors WHERE account = ? AND country = ?", (account, country)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _query(self, sql, params, columns):
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return pd.DataFrame(rows, columns=columns)
+
+    @staticmethod
+    def _window(account, country, since, until, imported):
+        """WHERE clause and parameters shared by orders, monthly_totals and restaurant_totals."""
+        sql = "account = ? AND country = ? AND date BETWEEN ? AND ?"
+        if not imported:
+            sql += " AND message_id NOT LIKE 'csv:%'"
+        until_ms = _epoch_ms(until) if until is not None else 2 ** 63 - 1
+        return sql, (account, country, _epoch_ms(since), until_ms)
+
+    def orders(self, account, country, since=None, until=None, imported=True):
+        """Every stored order as a DataFrame in local time, newest first; orders_dataframe compacts it.
+
+        `since` and `until` (Timestamps) bound the dates, inclusive. With
+        `imported=False`, rows that came from import_csv are left out, leaving
+        only orders fetched from Gmail; the same goes for the totals below.
+        """
+        where, params = self._window(account, country, since, until, imported)
+        df = self._query(
+            f"SELECT date, price, restaurant FROM orders WHERE {where} ORDER BY date DESC",
+            params, ['date', 'price', 'restaurant'],
+        )
+        df['date'] = pd.to_datetime(df['date'], unit='ms', utc=True).dt.tz_convert(COUNTRIES[country]["timezone"])
+        return df
+
+    def monthly_totals(self, account, country, since=None, until=None, imported=True):
+        """Spend and order count per local calendar month ('YYYY-MM'), oldest first, filtered like orders."""
+        # Both COUNTRIES zones have a fixed UTC offset (no DST), so shifting by it is exact.
+        offset = pd.Timestamp.now(tz=COUNTRIES[country]["timezone"]).utcoffset().total_seconds()
+        where, params = self._window(account, country, since, until, imported)
+        return self._query(
+            "SELECT strftime('%Y-%m', date / 1000, 'unixepoch', ?) AS month, SUM(price), COUNT(*) "
+            f"FROM orders WHERE {where} GROUP BY month ORDER BY month",
+            (f"{offset:+.0f} seconds", *params), ['month', 'total', 'orders'],
+        )
+
+    def restaurant_totals(self, account, country, limit=None, since=None, until=None, imported=True):
+        """Spend, order count and average order per restaurant, biggest spend first, filtered like orders."""
+        where, params = self._window(account, country, since, until, imported)
+        return self._query(
+            "SELECT restaurant, SUM(price) AS total, COUNT(*), AVG(price) FROM orders "
+            f"WHERE {where} GROUP BY restaurant ORDER BY total DESC LIMIT ?",
+            (*params, -1 if limit is None else limit),
+            ['restaurant', 'total', 'orders', 'average'],
+        )
+
+
+def _epoch_ms(timestamp):
+    """UTC epoch milliseconds of a Timestamp, or 0 for None."""
+    return 0 if timestamp is None else pd.Timestamp(timestamp).value // 1_000_000
+
+
+@st.cache_resource
+def get_order_database():
+    """Process-wide OrderDatabase, or None unless FOODPANDA_ORDER_DB_PATH names a file to keep it in."""
+    path = os.environ.get("FOODPANDA_ORDER_DB_PATH")
+    return OrderDatabase(path) if path else None
+
+
+def _account_key(profile):
+    """Opaque per-mailbox cache key, so email addresses never land in the cache."""
+    return hashlib.sha256(profile["emailAddress"].lower().encode("utf-8")).hexdigest()[:32]
+
+
+def _iter_through_cache(fetch, service, messages, cache, account, country):
+    """Run `fetch` over only the messages `cache` has no entry for.
+
+    Yields (index, message, cached) with indexes into `messages`. For cache hits
+    `message` is None and `cached` is the stored order (None for a known
+    non-receipt); for downloads `cached` is CACHE_MISS.
+    """
+    hits = collections.deque()
+    positions = []
+
+    def misses():
+        for position, msg in enumerate(messages):
+            cached = cache.get(account, msg["id"], country)
+            if cached is CACHE_MISS:
+                positions.append(position)
+                yield msg
+            else:
+                hits.append((position, None, cached))
+
+    for index, msg_details in fetch(service, misses()):
+        while hits:
+            yield hits.popleft()
+        yield positions[index], msg_details, CACHE_MISS
+    while hits:
+        yield hits.popleft()
+
+
+# Subject words every order receipt (or a forward of one) carries; promos don't.
+RECEIPT_SUBJECT_WORDS = ("order", "receipt")
+
+
+def _looks_like_receipt(metadata, country):
+    """Guess from a metadata-only messages.get response whether the message is an order receipt.
+
+    Errs towards yes: a false positive costs one body download, a false
+    negative loses an order. The subject is checked for RECEIPT_SUBJECT_WORDS
+    and the snippet for the country's currency.
+    """
+    headers = {h["name"].lower(): h["value"] for h in (metadata.get("payload") or {}).get("headers", [])}
+    subject = headers.get("subject", "").lower()
+    if any(word in subject for word in RECEIPT_SUBJECT_WORDS):
+        return True
+    return COUNTRIES[country]["currency"] in html.unescape(metadata.get("snippet", ""))
+
+
+def _iter_prefiltered(fetch, service, messages, country, counts):
+    """Run `fetch` in two passes: metadata for every message, full bodies only for likely receipts.
+
+    Yields (index, message) pairs like the fetch modes, with indexes into
+    `messages`; a message screened out by _looks_like_receipt comes back as None,
+    the same as a failed download. Messages whose metadata couldn't be fetched
+    are downloaded anyway. `counts` (a Counter) gets "metadata_fetched",
+    "metadata_bytes" and "downloads_avoided".
+    """
+    stubs = []
+    screened_out = collections.deque()
+    positions = []
+
+    def listed():
+        for msg in messages:
+            stubs.append(msg)
+            yield msg
+
+    def likely_receipts():
+        for index, metadata in fetch(service, listed(), transport=METADATA_TRANSPORT):
+            if metadata is not None:
+                counts["metadata_fetched"] += 1
+                counts["metadata_bytes"] += _payload_size(metadata)
+                if not _looks_like_receipt(metadata, country):
+                    counts["downloads_avoided"] += 1
+                    screened_out.append((index, None))
+                    continue
+            positions.append(index)
+            yield stubs[index]
+
+    for index, msg_details in fetch(service, likely_receipts()):
+        while screened_out:
+            yield screened_out.popleft()
+        yield positions[index], msg_details
+    while screened_out:
+        yield screened_out.popleft()
+
+
+# Gmail rejects batch requests carrying more than 100 calls.
+GMAIL_BATCH_SIZE = 100
+
+# Partial-response selector covering everything _parse_message and
+# _is_order_email read: headers plus mimeType/body data down the MIME tree.
+LEAN_MESSAGE_FIELDS = (
+    "id,internalDate,payload(mimeType,headers(name,value),body/data,"
+    "parts(mimeType,body/data,parts(mimeType,body/data,parts(mimeType,body/data,parts))))"
+)
+
+# Google only compresses a response when the User-Agent also mentions gzip.
+# googleapiclient sends both headers on every request by itself; the async
+# engine talks REST through httpx and needs them spelled out.
+_GZIP_HEADERS = {"accept-encoding": "gzip", "user-agent": "foodpanda-expense-tracker (gzip)"}
+
+# How messages.get requests are shaped on the wire; all of them are gzipped.
+# "lean" asks only for the fields we parse. "raw" fetches the RFC 822 source
+# instead of the JSON MIME tree; which is cheaper depends on the mail (see
+# `benchmark.py transport`).
+TRANSPORTS = {
+    "full": {"params": {}, "headers": _GZIP_HEADERS},
+    "lean": {"params": {"fields": LEAN_MESSAGE_FIELDS}, "headers": _GZIP_HEADERS},
+    "raw": {"params": {"format": "raw", "fields": "id,internalDate,raw"}, "headers": _GZIP_HEADERS},
+}
+DEFAULT_TRANSPORT = "lean"
+# Not a user-facing transport: the cheap first pass of a prefiltered fetch only
+# needs the headers and snippet _looks_like_receipt reads, never the MIME tree.
+METADATA_TRANSPORT = "metadata"
+_REQUEST_SHAPES = {
+    **TRANSPORTS,
+    METADATA_TRANSPORT: {
+        "params": {"format": "metadata", "metadataHeaders": ["From", "Subject"],
+                   "fields": "id,snippet,payload/headers(name,value)"},
+        "headers": _GZIP_HEADERS,
+    },
+}
+
+
+def _message_request(service, msg_id, transport=DEFAULT_TRANSPORT):
+    """Build (but don't execute) a messages.get request shaped by `transport`."""
+    config = _REQUEST_SHAPES[transport]
+    request = service.users().messages().get(userId="me", id=msg_id, **config["params"])
+    request.headers.update(config["headers"])
+    return request
+
+
+# Gmail's per-user ceiling and what each call we make costs against it.
+GMAIL_QUOTA_PER_USER_PER_SECOND = 250
+GMAIL_QUOTA_UNITS = {
+    "messages.get": 5,
+    "messages.list": 5,
+    "history.list": 2,
+    "getProfile": 1,
+}
+
+
+def _is_rate_limited(error):
+    """Whether an exception is Gmail throttling us: a 429, or a 403 with a rate-limit reason."""
+    if isinstance(error, googleapiclient.errors.HttpError):
+        status, content = error.resp.status, error.content
+    elif isinstance(error, httpx.HTTPStatusError):
+        status, content = error.response.status_code, error.response.content
+    else:
+        return False
+    if status == 429:
+        return True
+    # userRateLimitExceeded / rateLimitExceeded; other 403s are real permission errors.
+    return status == 403 and b"ratelimitexceeded" in (content or b"").lower()
+
+
+class RateLimitedError(RuntimeError):
+    """Gmail was still throttling some calls when the QuotaScheduler deadline passed."""
+
+
+class QuotaScheduler:
+    """Paces Gmail calls under the per-user quota and retries throttled ones.
+
+    Quota units are spent on a token-bucket schedule with one second of burst.
+    Concurrency follows AIMD: the slot limit grows by one per limit's worth of
+    successful calls and halves whenever Gmail throttles us. Throttled calls are
+    retried with full-jitter exponential backoff until they go through or
+    `deadline` seconds have passed since the scheduler was created; calls given
+    up on then are counted in `failed_throttled` rather than lost silently.
+    """
+
+    def __init__(self, quota_per_second=GMAIL_QUOTA_PER_USER_PER_SECOND, initial_concurrency=4,
+                 max_concurrency=64, deadline=600.0, base_delay=0.5, max_delay=32.0):
+        self.quota_per_second = quota_per_second
+        self.max_concurrency = max_concurrency
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        if quota_per_second == float("inf"):
+            # No quota to probe for, so there's nothing for a slow start to protect.
+            initial_concurrency = max_concurrency
+        self.concurrency = float(min(initial_concurrency, max_concurrency))
+        self.units_spent = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failed_throttled = 0
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(self._lock)
+        # Created on first acall, inside the event loop that will wait on it.
+        self._async_slots = None
+        self._in_flight = 0
+        self._quota_clock = time.monotonic()
+        self._deadline = self._quota_clock + deadline
+
+    @property
+    def limit(self):
+        return max(1, int(self.concurrency))
+
+    def reserve(self, units):
+        """Spend `units` of quota and return how many seconds to wait before sending."""
+        with self._lock:
+            now = time.monotonic()
+            self.units_spent += units
+            self._quota_clock = max(self._quota_clock, now) + units / self.quota_per_second
+            # One second of quota may be spent ahead of schedule.
+            return max(0.0, self._quota_clock - 1.0 - now)
+
+    def record_success(self):
+        with self._slots:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._slots.notify_all()
+
+    def record_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            self.concurrency = max(1.0, self.concurrency / 2)
+
+    def expired(self):
+        """True once throttled calls should stop being retried."""
+        return time.monotonic() >= self._deadline
+
+    def record_failed_throttle(self, calls=1):
+        """Count `calls` that were still being throttled when the deadline passed."""
+        with self._lock:
+            self.failed_throttled += calls
+
+    def _give_up(self, error):
+        """Whether a call that raised `error` should stop being retried, counting it if it was throttled."""
+        if not _is_rate_limited(error):
+            return True
+        if self.expired():
+            self.record_failed_throttle()
+            return True
+        return False
+
+    def wait_before_retry(self, attempt):
+        """Sleep a full-jitter exponential backoff before retry number `attempt + 1`."""
+        with self._lock:
+            self.retries += 1
+        time.sleep(self._backoff(attempt))
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one of the `limit` concurrent call slots."""
+        with self._slots:
+            while self._in_flight >= self.limit:
+                self._slots.wait()
+            self._in_flight += 1
         try:
-            price_str = decoded_content.split('Order Total')[1].split('Tk')[1].split('\n')[0].strip()
-            price_match = re.search(r'([\d,]+\.?\d*)', price_str)
-            price = float(price_match.group(1).replace(',', '')) if price_match else 0
-        except Exception:
-            price = 0
+            yield
+        finally:
+            with self._slots:
+                self._in_flight -= 1
+                self._slots.notify_all()
+
+    def call(self, fn, units):
+        """Run the Gmail call `fn()`, costing `units`, under quota and AIMD limits."""
+        for attempt in itertools.count():
+            with self.slot():
+                time.sleep(self.reserve(units))
+                try:
+                    result = fn()
+                except Exception as e:
+                    if self._give_up(e):
+                        raise
+                    self.record_throttle()
+                else:
+                    self.record_success()
+                    return result
+            self.wait_before_retry(attempt)
+
+    async def acall(self, fn, units):
+        """Async counterpart of call for the asyncio engine; `fn()` returns an awaitable."""
+        if self._async_slots is None:
+            self._async_slots = asyncio.Condition()
+        slots = self._async_slots
+        for attempt in itertools.count():
+            async with slots:
+                await slots.wait_for(lambda: self._in_flight < self.limit)
+                self._in_flight += 1
+            try:
+                await asyncio.sleep(self.reserve(units))
+                try:
+                    result = await fn()
+                except Exception as e:
+                    if self._give_up(e):
+                        raise
+                    self.record_throttle()
+                else:
+                    self.record_success()
+                    return result
+            finally:
+                async with slots:
+                    self._in_flight -= 1
+                    # Wake only as many waiters as there are free slots; a success may have added one.
+                    slots.notify(max(0, self.limit - self._in_flight))
+            with self._lock:
+                self.retries += 1
+            await asyncio.sleep(self._backoff(attempt))
+
+    def stats(self):
+        return {"quota_units": self.units_spent, "throttled": self.throttled, "retries": self.retries,
+                "failed_throttled": self.failed_throttled}
+
+
+def _execute(request, method, scheduler=None):
+    """Execute a googleapiclient request, through `scheduler` when there is one."""
+    if scheduler is None:
+        return request.execute()
+    return scheduler.call(request.execute, GMAIL_QUOTA_UNITS[method])
+
+
+def _payload_size(msg_details):
+    """Size of a fetched message as compact JSON.
+
+    googleapiclient only hands back the decoded response, so this is what the
+    message decodes to, not the gzipped bytes that came over the wire.
+    """
+    return len(json.dumps(msg_details, separators=(",", ":")))
 
+
+def _iter_messages_serial(service, messages, transport=DEFAULT_TRANSPORT, scheduler=None):
+    """Yield (index, message) pairs, one messages.get round trip per email.
+
+    `message` is None when the fetch failed, so the caller can count it as skipped.
+    """
+    for i, msg in enumerate(messages):
         try:
-            match = re.search(r'Store\s+([^\n<]+)', decoded_content)
-            restaurant = match.group(1).strip() if match else "Panda Mart"
+            msg_details = _execute(_message_request(service, msg["id"], transport), "messages.get", scheduler)
         except Exception:
-            restaurant = "Panda Mart"
+            msg_details = None
+        yield i, msg_details
 
-        return price, restaurant
 
-    # Default: Pakistan format
-    try:
-        price_str = decoded_content.split('Total')[1].split('PKR')[1].split('\n')[0].strip()
-    except Exception:
+def _iter_messages_batched(service, messages, transport=DEFAULT_TRANSPORT, scheduler=None,
+                           batch_size=GMAIL_BATCH_SIZE):
+    """Yield (index, message) pairs fetched through Gmail HTTP batch requests.
+
+    Up to `batch_size` messages.get calls share a single HTTPS round trip, which is
+    what makes a year of receipts take seconds instead of minutes. Items Gmail
+    throttles are re-sent in a follow-up batch after a backoff until the
+    scheduler's deadline; items that fail for any other reason come back as
+    None, same as in the serial path.
+    """
+    scheduler = scheduler or QuotaScheduler()
+    messages = iter(messages)
+    start = 0
+    while True:
+        chunk = list(itertools.islice(messages, batch_size))
+        if not chunk:
+            return
+        results = [None] * len(chunk)
+        pending = list(range(len(chunk)))
+
+        for attempt in itertools.count():
+            throttled = []
+
+            def collect(request_id, response, exception):
+                if exception is None:
+                    results[int(request_id)] = response
+                elif _is_rate_limited(exception):
+                    throttled.append(int(request_id))
+
+            batch = service.new_batch_http_request(callback=collect)
+            for offset in pending:
+                batch.add(_message_request(service, chunk[offset]["id"], transport), request_id=str(offset))
+            time.sleep(scheduler.reserve(GMAIL_QUOTA_UNITS["messages.get"] * len(pending)))
+            try:
+                batch.execute()
+            except Exception as e:
+                if not _is_rate_limited(e):
+                    # The whole round trip failed; every item in it stays None and is skipped.
+                    break
+                throttled = pending
+
+            if not throttled:
+                scheduler.record_success()
+                break
+            scheduler.record_throttle()
+            pending = throttled
+            if scheduler.expired():
+                scheduler.record_failed_throttle(len(pending))
+                break
+            scheduler.wait_before_retry(attempt)
+
+        for offset, msg_details in enumerate(results):
+            yield start + offset, msg_details
+        start += len(chunk)
+
+
+DEFAULT_FETCH_WORKERS = 8
+
+
+def _iter_messages_threaded(service, messages, transport=DEFAULT_TRANSPORT, scheduler=None, service_factory=None,
+                            workers=DEFAULT_FETCH_WORKERS):
+    """Yield (index, message) pairs downloaded by a pool of worker threads.
+
+    httplib2 isn't thread-safe, so every worker builds its own Gmail service with
+    `service_factory` on first use instead of sharing `service`. Pairs come out in
+    completion order; the caller uses the index to restore list order. Finished
+    downloads are handed back while `messages` is still being listed. The
+    scheduler's AIMD limit decides how many of the `workers` are calling Gmail.
+    """
+    scheduler = scheduler or QuotaScheduler(initial_concurrency=workers, max_concurrency=workers)
+    if service_factory is None:
+        raise ValueError("Threaded fetching needs a service_factory to build per-worker Gmail services")
+
+    local = threading.local()
+
+    def fetch_one(msg):
+        if not hasattr(local, "service"):
+            local.service = service_factory()
+        return _execute(_message_request(local.service, msg["id"], transport), "messages.get", scheduler)
+
+    finished = queue.Queue()
+
+    def submit(pool, index, msg):
+        future = pool.submit(fetch_one, msg)
+        future.add_done_callback(lambda f: finished.put((index, f)))
+
+    def drain(block):
+        # Runs on whichever thread iterates this generator (Pipeline's feeder thread in
+        # get_emails_from_sender), never the script thread: no st.* calls here.
+        index, future = finished.get(block=block)
         try:
-            price_str = decoded_content.split('Received')[1].split('Rs.')[1].split('\n')[0].strip()
+            return index, future.result()
         except Exception:
-            price_str = ""
+            return index, None
 
-    try:
-        price = float(price_str.replace(',', ''))
-    except Exception:
-        price = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        submitted = 0
+        yielded = 0
+        for index, msg in enumerate(messages):
+            submit(pool, index, msg)
+            submitted += 1
+            while not finished.empty():
+                yield drain(block=False)
+                yielded += 1
+        while yielded < submitted:
+            yield drain(block=True)
+            yielded += 1
 
-    try:
-        match = re.search(r'Partner:\s*Name:\s*(.+)', decoded_content)
-        restaurant = match.group(1).strip() if match else "Panda Mart"
-    except Exception:
-        restaurant = "Panda Mart"
 
-    return price, restaurant
+# messages.list refuses page sizes above 500.
+GMAIL_LIST_PAGE_SIZE = 500
+
 
-def get_emails_from_sender(service, sender_email, country="Pakistan", currency="PKR", days=365, max_results=1000):
-    # indicate that it will only process 1000 emails
-    st.write("This will only process latest 1000 emails")
-    """Fetching Emails from Foodpanda"""
-    # Create placeholder metrics for real-time updates
-    progress_counter = st.empty()
-    current_total = st.empty()
-    emails_processed = st.empty()
-    skipped_counter = st.empty()
+def _iter_message_ids(service, query, max_results=None, on_page=None, scheduler=None):
+    """Yield message stubs ({'id', 'threadId'}) for `query`, following nextPageToken.
 
-    running_total = 0
-    processed_count = 0
-    skipped_count = 0
+    Each page is handed out as soon as it arrives, so a lazy consumer can fetch
+    page one while page two is still being listed. `max_results=None` lists the
+    whole mailbox window. `on_page(listed, done)` is called after every page with
+    the running count and whether listing has finished.
+    """
+    listed = 0
+    page_token = None
+    while max_results is None or listed < max_results:
+        page_size = GMAIL_LIST_PAGE_SIZE if max_results is None else min(GMAIL_LIST_PAGE_SIZE, max_results - listed)
+        request = service.users().messages().list(
+            userId="me",
+            maxResults=page_size,
+            q=query,
+            pageToken=page_token,
+        )
+        page = _execute(request, "messages.list", scheduler)
+        messages = page.get("messages", [])[:page_size]
+        page_token = page.get("nextPageToken")
+        listed += len(messages)
+        if on_page:
+            on_page(listed, not page_token or listed == max_results)
+        yield from messages
+        if not page_token:
+            return
 
-    # Rest of the existing setup code...
-    now = datetime.datetime.now()
-    days_ago = now - datetime.timedelta(days=days)
-    after_timestamp = int(time.mktime(days_ago.timetuple()))
 
+def _sender_clause(sender_email, country):
+    """Gmail search terms matching the country's order emails, with no date window."""
     # Broaden query to include forwarded emails: Gmail's `from:` only matches
     # the outer From header, so forwarded receipts (which have the forwarder's
     # address as From) get missed. We OR in a clause that matches any email
@@ -203,81 +1228,893 @@ def get_emails_from_sender(service, sender_email, country="Pakistan", currency="
     # original sender address — that catches forwards reliably.
     order_subject = COUNTRIES.get(country, {}).get("order_subject")
     if order_subject:
-        query = (
-            f'(from:{sender_email} OR (subject:"{order_subject}" "{sender_email}")) '
-            f'after:{after_timestamp}'
-        )
-    else:
-        query = f"from:{sender_email} after:{after_timestamp}"
+        return f'(from:{sender_email} OR (subject:"{order_subject}" "{sender_email}"))'
+    return f"from:{sender_email}"
+
 
+def _window_start(days):
+    """Epoch seconds `days` days ago, for Gmail's after: operator."""
+    days_ago = datetime.datetime.now() - datetime.timedelta(days=days)
+    return int(time.mktime(days_ago.timetuple()))
+
+
+def _build_query(sender_email, country, days):
+    """Gmail search query matching the country's order emails from the last `days` days."""
+    return f"{_sender_clause(sender_email, country)} after:{_window_start(days)}"
+
+
+def _build_shard_queries(sender_email, country, days, shards):
+    """Split _build_query's window into `shards` after:/before: queries, newest first.
+
+    Inner boundaries are widened by a second on both sides so nothing sent right
+    on one falls between two shards; _iter_message_ids_sharded drops the repeats.
+    """
+    start = _window_start(days)
+    end = int(time.time()) + 1
+    bounds = [start + (end - start) * i // shards for i in range(shards + 1)]
+    clause = _sender_clause(sender_email, country)
+    return [
+        f"{clause} after:{bounds[i] - 1 if i else start} before:{bounds[i + 1] + 1}"
+        for i in reversed(range(shards))
+    ]
+
+
+# Date shards listed in parallel when the whole window is wanted.
+DEFAULT_LIST_SHARDS = 4
+_SHARD_DONE = object()
+
+
+def _iter_message_ids_sharded(service_factory, queries, on_page=None, scheduler=None, skip_ids=()):
+    """Yield message stubs for several date-shard `queries` listed in parallel.
+
+    Each shard is paginated on its own thread with its own Gmail service, so
+    listing a multi-year mailbox takes as long as its largest shard rather than
+    its total page count. Stubs come out in shard order (newest first), streaming
+    the first shard while the rest are still being listed, and an ID seen in an
+    earlier shard is never yielded twice. IDs in `skip_ids` were handed out
+    already and aren't yielded at all. `on_page(listed, done)` gets the running
+    count of unique IDs, `skip_ids` included.
+    """
+    inboxes = [queue.Queue() for _ in queries]
+    seen = set(skip_ids)
+    lock = threading.Lock()
+    stopped = threading.Event()
+    listed = len(seen)
+    remaining = len(queries)
+
+    def list_shard(inbox, query):
+        nonlocal listed, remaining
+        try:
+            for msg in _iter_message_ids(service_factory(), query, scheduler=scheduler):
+                if stopped.is_set():
+                    return
+                with lock:
+                    if msg["id"] in seen:
+                        continue
+                    seen.add(msg["id"])
+                    listed += 1
+                    count = listed
+                inbox.put(msg)
+                if on_page:
+                    on_page(count, False)
+        except Exception as e:
+            inbox.put(_PipelineFailure(e))
+        finally:
+            with lock:
+                remaining -= 1
+                count, done = listed, remaining == 0
+            if on_page and done:
+                on_page(count, True)
+            inbox.put(_SHARD_DONE)
+
+    for inbox, query in zip(inboxes, queries):
+        threading.Thread(target=list_shard, args=(inbox, query), daemon=True).start()
     try:
-        results = service.users().messages().list(
-            userId="me",
-            maxResults=max_results,
-            q=query
-        ).execute()
+        for inbox in inboxes:
+            while (msg := inbox.get()) is not _SHARD_DONE:
+                if isinstance(msg, _PipelineFailure):
+                    raise msg.error
+                yield msg
+    finally:
+        stopped.set()
+
+
+def _iter_message_ids_whole_window(service, service_factory, sender_email, country, days, shards, on_page=None,
+                                  scheduler=None):
+    """Yield message stubs for the whole `days` window, sharding only when it runs past one page.
+
+    The first page is listed on `service`. Only when Gmail reports more pages is
+    the window split into `shards` parallel listings, each building a service
+    with `service_factory`, so the common one-page mailbox never pays for extra
+    services. The newest shard lists the first page again; those IDs are dropped.
+    """
+    request = service.users().messages().list(
+        userId="me",
+        maxResults=GMAIL_LIST_PAGE_SIZE,
+        q=_build_query(sender_email, country, days),
+    )
+    page = _execute(request, "messages.list", scheduler)
+    messages = page.get("messages", [])
+    more = bool(page.get("nextPageToken"))
+    if on_page:
+        on_page(len(messages), not more)
+    yield from messages
+    if more:
+        queries = _build_shard_queries(sender_email, country, days, shards)
+        yield from _iter_message_ids_sharded(service_factory, queries, on_page=on_page, scheduler=scheduler,
+                                             skip_ids=[msg["id"] for msg in messages])
+
+
+# How get_emails_from_sender downloads message bodies. Every mode yields
+# (index, message) pairs; only "threaded" yields them out of list order.
+FETCH_MODES = {
+    "batch": _iter_messages_batched,
+    "threaded": _iter_messages_threaded,
+    "serial": _iter_messages_serial,
+}
+DEFAULT_FETCH_MODE = "batch"
+
+# Items a pipeline queue holds before the stage feeding it has to wait.
+PIPELINE_QUEUE_SIZE = 256
+_PIPELINE_DONE = object()
+
+
+class _PipelineFailure:
+    """Carries an exception raised inside a pipeline thread out to the consumer."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class Pipeline:
+    """Streams items from `source` through `stages`, each on its own thread.
+
+    Stages are (name, fn) pairs joined by bounded queues, so parsing overlaps with
+    the downloads still in flight and memory stays capped at `maxsize` items per
+    queue. Iterating the pipeline yields the last stage's outputs on the calling
+    thread, where Streamlit calls are legal. `depths()` reports the backlog in
+    front of each stage: a queue that sits full means the stage draining it is
+    the bottleneck, one that sits empty means that stage is starved.
+    """
+
+    def __init__(self, source, stages, maxsize=PIPELINE_QUEUE_SIZE):
+        self._source = source
+        self._stages = list(stages)
+        self._names = [name for name, _ in self._stages] + ["output"]
+        self._queues = [queue.Queue(maxsize) for _ in self._names]
+        self._peaks = [0] * len(self._names)
+        self._depth_totals = [0] * len(self._names)
+        self._samples = [0] * len(self._names)
+        self._stopped = threading.Event()
+
+    def depths(self):
+        """{stage: {"current", "peak", "mean"}} queue depth in front of each stage."""
+        return {
+            name: {
+                "current": q.qsize(),
+                "peak": self._peaks[i],
+                "mean": self._depth_totals[i] / self._samples[i] if self._samples[i] else 0.0,
+            }
+            for i, (name, q) in enumerate(zip(self._names, self._queues))
+        }
+
+    def _put(self, position, item):
+        q = self._queues[position]
+        while not self._stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            depth = q.qsize()
+            self._peaks[position] = max(self._peaks[position], depth)
+            self._depth_totals[position] += depth
+            self._samples[position] += 1
+            return True
+        return False
+
+    def _get(self, position):
+        while not self._stopped.is_set():
+            try:
+                return self._queues[position].get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _PIPELINE_DONE
+
+    def _feed(self):
+        try:
+            for item in self._source:
+                if not self._put(0, item):
+                    return
+        except Exception as e:
+            self._put(0, _PipelineFailure(e))
+        self._put(0, _PIPELINE_DONE)
+
+    def _run_stage(self, position, fn):
+        while True:
+            item = self._get(position)
+            if item is not _PIPELINE_DONE and not isinstance(item, _PipelineFailure):
+                try:
+                    item = fn(item)
+                except Exception as e:
+                    item = _PipelineFailure(e)
+            if not self._put(position + 1, item) or item is _PIPELINE_DONE:
+                return
+
+    def __iter__(self):
+        threads = [threading.Thread(target=self._feed, daemon=True)]
+        threads += [
+            threading.Thread(target=self._run_stage, args=(position, fn), daemon=True)
+            for position, (_, fn) in enumerate(self._stages)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(len(self._stages))
+                if item is _PIPELINE_DONE:
+                    return
+                if isinstance(item, _PipelineFailure):
+                    raise item.error
+                yield item
+        finally:
+            # Unblocks every stage if the consumer stops early or raises.
+            self._stopped.set()
+
+
+# Progress redraws per second while emails are being processed.
+PROGRESS_FRAMES_PER_SECOND = 10
+
+
+class ProgressReporter:
+    """Live ingestion progress that redraws at most a few times a second.
+
+    Every redraw sends four element deltas over the websocket, which on a large
+    mailbox costs more than parsing. `update` is called once per email and only
+    redraws when a frame is due (`fps`), or every `every` emails if given;
+    `finish` always draws the final state before `clear` removes the elements.
+    Counters are lock-protected so worker threads may call `update`; only the
+    thread that created the reporter (the script thread) draws. Requests a
+    `scheduler` gave up on because Gmail kept throttling them are reported on
+    their own line instead of as skipped emails.
+    """
 
-        messages = results.get("messages", [])
+    def __init__(self, currency, fps=PROGRESS_FRAMES_PER_SECOND, every=None, scheduler=None):
+        self.currency = currency
+        self.scheduler = scheduler
+        self.every = every
+        self.interval = 1 / fps if fps else float("inf")
+        self.done = 0
+        self.listed = 0
+        self.listing_done = False
+        self.running_total = 0
+        self.processed = 0
+        self.skipped = 0
+        self.frames = 0
+        self._lock = threading.Lock()
+        self._owner = threading.get_ident()
+        self._last_frame = float("-inf")
+        self._last_done = 0
+        self._progress = st.empty()
+        self._total = st.empty()
+        self._orders = st.empty()
+        self._skipped = st.empty()
+        self._failed = st.empty()
+
+    def update(self, done, listed, listing_done, order):
+        """Record one processed email (`order` is None when it was skipped)."""
+        with self._lock:
+            self.done = max(self.done, done)
+            self.listed = max(self.listed, listed)
+            self.listing_done = listing_done
+            if order is None:
+                self.skipped += 1
+            else:
+                self.processed += 1
+                self.running_total += order[1]
+            now = time.monotonic()
+            due = now - self._last_frame >= self.interval
+            if self.every:
+                due = due or self.done - self._last_done >= self.every
+            if not due or threading.get_ident() != self._owner:
+                return
+            self._last_frame = now
+            self._last_done = self.done
+        self._draw()
+
+    def finish(self):
+        """Draw the final state, whatever the frame schedule says."""
+        self._draw()
+
+    def clear(self):
+        self._progress.empty()
+        self._total.empty()
+        self._orders.empty()
+        self._skipped.empty()
+        self._failed.empty()
+
+    def _draw(self):
+        with self._lock:
+            done, listed_count, running_total = self.done, self.listed, self.running_total
+            processed, skipped = self.processed, self.skipped
+            failed = self.scheduler.failed_throttled if self.scheduler else 0
+            skipped = max(0, skipped - failed)
+            # While listing is still running the total is a lower bound.
+            listed = f"{listed_count}" if self.listing_done else f"{listed_count}+"
+            self.frames += 1
+        if listed_count:
+            self._progress.progress(min(done / listed_count, 1.0), f"Processing email {done} of {listed}")
+        self._total.metric("Running Total", f"{self.currency} {running_total:,.2f}")
+        self._orders.metric("Orders Found", f"{processed}/{listed}")
+        if skipped:
+            self._skipped.caption(f"Skipped {skipped} non-receipt or unparseable emails")
+        if failed:
+            self._failed.caption(f"⚠️ Gave up on {failed} Gmail requests that stayed rate-limited")
+
+
+def get_emails_from_sender(service, sender_email, country="Pakistan", currency="PKR", days=365, max_results=None,
+                           fetch_mode=DEFAULT_FETCH_MODE, workers=DEFAULT_FETCH_WORKERS, service_factory=None,
+                           sync_state=None, transport=DEFAULT_TRANSPORT, fetch_stats=None, scheduler=None,
+                           cache=None, list_shards=DEFAULT_LIST_SHARDS, prefilter=False, order_db=None):
+    """Fetching Emails from Foodpanda
+
+    Lists every matching email (or the newest `max_results`) page by page and
+    downloads each page while the next one is listed. Pass a `sync_state` dict to
+    record the mailbox history cursor for a later sync_new_emails call, and a
+    `fetch_stats` dict to get message, byte and quota counts back. All Gmail calls
+    go through `scheduler` (a fresh QuotaScheduler by default). With a
+    MessageCache, only messages it hasn't seen are downloaded. Decoding and
+    parsing run in a Pipeline behind the downloads; `fetch_stats["queue_depths"]`
+    shows which stage the backlog piled up in front of. When the whole window is
+    wanted, runs past one page and a `service_factory` is given, listing is
+    split into `list_shards` date shards that are paginated in parallel. With
+    `prefilter`, a metadata pass screens out promos and other non-receipts
+    before their bodies are downloaded (see _iter_prefiltered); it costs one
+    extra messages.get per message, so it pays off when the query matches many
+    non-receipts. Orders found are also upserted into `order_db` (an
+    OrderDatabase) when given.
+    """
+    if scheduler is None:
+        # Shard listings run side by side, so they need a slot each.
+        concurrency = max(workers if fetch_mode == "threaded" else 1, list_shards)
+        scheduler = QuotaScheduler(initial_concurrency=concurrency, max_concurrency=concurrency)
+    progress = ProgressReporter(currency, scheduler=scheduler)
+    total_messages = 0
+    listing_done = False
+    bytes_received = 0
+    cache_hits = 0
+    prefilter_counts = collections.Counter()
+
+    def on_page(listed, done):
+        nonlocal total_messages, listing_done
+        total_messages = listed
+        listing_done = done
+
+    query = _build_query(sender_email, country, days)
 
-        if not messages:
+    try:
+        profile = None
+        if sync_state is not None or cache is not None or order_db is not None:
+            profile = _get_profile(service, scheduler)
+        if profile is None:
+            # Without the mailbox address there's no safe cache or database key.
+            cache = order_db = None
+
+        if list_shards > 1 and max_results is None and service_factory is not None:
+            messages = _iter_message_ids_whole_window(service, service_factory, sender_email, country, days,
+                                                      list_shards, on_page=on_page, scheduler=scheduler)
+        else:
+            messages = _iter_message_ids(service, query, max_results=max_results, on_page=on_page,
+                                         scheduler=scheduler)
+        if sync_state is not None:
+            messages = _start_sync_cursor(sync_state, messages, profile)
+        message_ids = []
+
+        def noting_ids(messages):
+            for msg in messages:
+                message_ids.append(msg["id"])
+                yield msg
+
+        messages = noting_ids(messages)
+        # Keyed by list position so out-of-order fetch modes still produce
+        # data_dict in Gmail's (newest first) order.
+        orders = {}
+
+        fetch = functools.partial(FETCH_MODES[fetch_mode], transport=transport, scheduler=scheduler)
+        if fetch_mode == "threaded":
+            fetch = functools.partial(fetch, service_factory=service_factory, workers=workers)
+        if prefilter:
+            fetch = functools.partial(_iter_prefiltered, fetch, country=country, counts=prefilter_counts)
+        if cache is not None:
+            account = _account_key(profile)
+            results = _iter_through_cache(fetch, service, messages, cache, account, country)
+        else:
+            results = ((index, msg_details, CACHE_MISS) for index, msg_details in fetch(service, messages))
+
+        prefix_bytes = _body_prefix_bytes(cache)
+
+        def decode(item):
+            index, msg_details, cached = item
+            date = decoded_content = None
+            truncated = False
+            size = 0
+            if cached is CACHE_MISS and msg_details:
+                size = _payload_size(msg_details)
+                try:
+                    date, decoded_content, truncated = _message_date_and_body(msg_details, prefix_bytes)
+                except Exception:
+                    msg_details = None
+            return index, msg_details, cached, date, decoded_content, truncated, size
+
+        def parse(item):
+            index, msg_details, cached, date, decoded_content, truncated, size = item
+            if cached is not CACHE_MISS:
+                return index, cached, True, size
+            order = None
+            try:
+                if msg_details:
+                    decoded_content, order = _parse_decoded(msg_details, date, decoded_content, truncated, country)
+                    if cache is not None:
+                        cache.put(account, msg_details["id"], country, date, decoded_content, order)
+            except Exception:
+                # One bad email shouldn't kill the whole batch.
+                order = None
+            return index, order, False, size
+
+        # Downloads, base64/MIME decoding and parsing run as separate stages, so
+        # CPU work on one page overlaps with the network wait for the next.
+        pipeline = Pipeline(results, [("decode", decode), ("parse", parse)])
+        for i, (index, order, from_cache, size) in enumerate(pipeline, 1):
+            cache_hits += from_cache
+            bytes_received += size
+
+            if order is not None:
+                orders[index] = order
+            progress.update(i, total_messages, listing_done, order)
+
+        progress.finish()
+        progress.clear()
+        if cache is not None:
+            cache.flush()
+
+        if fetch_stats is not None:
+            fetch_stats.update(
+                transport=transport, messages=total_messages - cache_hits - prefilter_counts["downloads_avoided"],
+                bytes=bytes_received, bytes_kind="of decoded JSON",
+                cache_hits=cache_hits, queue_depths=pipeline.depths(), progress_frames=progress.frames,
+                **prefilter_counts, **scheduler.stats(),
+            )
+
+        if not total_messages:
             st.warning(f"No emails found from {sender_email} in the last {days} days.")
             return
 
-        total_messages = len(messages)
         data_dict = {'date': [], 'price': [], 'restaurant': []}
+        for index in sorted(orders):
+            date, price, restaurant = orders[index]
+            data_dict['date'].append(date)
+            data_dict['price'].append(price)
+            data_dict['restaurant'].append(restaurant)
+        if order_db is not None:
+            order_db.upsert(_account_key(profile), country, [message_ids[index] for index in sorted(orders)],
+                            data_dict)
+            # A cursor saved past orders Gmail never let us download would hide them from every later refresh.
+            if sync_state is not None and "history_id" in sync_state and not scheduler.failed_throttled:
+                order_db.save_cursor(_account_key(profile), country, sync_state["history_id"])
+        return data_dict
 
-        for i, msg in enumerate(messages, 1):
-            try:
-                msg_details = service.users().messages().get(
-                    userId="me",
-                    id=msg["id"]
-                ).execute()
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+        return None
 
-                headers = msg_details["payload"]["headers"]
-                date = next((h["value"] for h in headers if h["name"] == "Date"), "No Date")
-                decoded_content = _extract_text_body(msg_details["payload"])
+def _get_profile(service, scheduler=None):
+    """The mailbox profile (emailAddress, historyId), or None if Gmail won't give it to us."""
+    try:
+        return _execute(service.users().getProfile(userId="me"), "getProfile", scheduler)
+    except Exception:
+        return None
 
-                if not decoded_content:
-                    skipped_count += 1
-                    continue
 
-                price, restaurant = parse_order_email(decoded_content, country)
+def _start_sync_cursor(sync_state, messages, profile):
+    """Record the mailbox historyId in `sync_state`, then pass `messages` through, noting their IDs.
 
-                # Skip non-receipt emails (promos, status updates) where the
-                # parser couldn't find an order total.
-                if price == 0:
-                    skipped_count += 1
-                    continue
+    `profile` is fetched before listing starts, so anything that arrives mid-sync
+    shows up in the next history call instead of falling through the gap.
+    """
+    if profile is not None:
+        sync_state["history_id"] = profile["historyId"]
+        sync_state["account"] = _account_key(profile)
+    else:
+        # No cursor just means the next refresh does a full sync.
+        sync_state.pop("history_id", None)
+    seen_ids = sync_state["message_ids"] = set()
+    for msg in messages:
+        seen_ids.add(msg["id"])
+        yield msg
 
-                data_dict['date'].append(date)
-                data_dict['price'].append(price)
-                data_dict['restaurant'].append(restaurant)
 
-                # Update running totals and progress
-                running_total += price
-                processed_count += 1
-            except Exception:
-                # One bad email shouldn't kill the whole batch.
-                skipped_count += 1
+def _is_order_email(msg_details, sender_email, country):
+    """Whether a message is from the country's Foodpanda sender (or a forward of its order email).
 
-            # Update progress indicators (always, so the user sees movement)
-            progress_counter.progress(i / total_messages, f"Processing email {i} of {total_messages}")
-            current_total.metric("Running Total", f"{currency} {running_total:,.2f}")
-            emails_processed.metric("Orders Found", f"{processed_count}/{total_messages}")
-            if skipped_count:
-                skipped_counter.caption(f"Skipped {skipped_count} non-receipt or unparseable emails")
+    The history API can't filter by query, so this stands in for _build_query.
+    """
+    headers = {h["name"].lower(): h["value"] for h in msg_details["payload"]["headers"]}
+    if sender_email in headers.get("from", ""):
+        return True
+    order_subject = COUNTRIES.get(country, {}).get("order_subject")
+    return bool(order_subject) and order_subject in headers.get("subject", "")
 
-        # Clear progress indicators
-        progress_counter.empty()
-        current_total.empty()
-        emails_processed.empty()
-        skipped_counter.empty()
 
-        return data_dict
+def sync_new_emails(service, sync_state, country="Pakistan", order_db=None):
+    """Fetch only the orders that arrived since the cursor in `sync_state`.
+
+    Walks the Gmail history API from the recorded historyId, downloads the newly
+    added messages in batches and advances the cursor. Returns a data_dict of new
+    orders (newest first, possibly empty), or None when Gmail no longer keeps
+    history that far back and a full sync is needed. New orders are upserted
+    into `order_db` under the account the cursor was recorded for. Raises
+    RateLimitedError, leaving the cursor where it was, if Gmail throttled some
+    downloads for longer than the scheduler's deadline.
+    """
+    sender_email = COUNTRIES[country]["sender"]
+    scheduler = QuotaScheduler()
+    seen_ids = sync_state.setdefault("message_ids", set())
+    added = []
+    history_id = sync_state["history_id"]
+    page_token = None
+    try:
+        while True:
+            request = service.users().history().list(
+                userId="me",
+                startHistoryId=sync_state["history_id"],
+                historyTypes=["messageAdded"],
+                pageToken=page_token,
+            )
+            page = _execute(request, "history.list", scheduler)
+            for record in page.get("history", []):
+                for added_msg in record.get("messagesAdded", []):
+                    msg = added_msg["message"]
+                    if msg["id"] not in seen_ids:
+                        seen_ids.add(msg["id"])
+                        added.append(msg)
+            history_id = page.get("historyId", history_id)
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                break
+    except googleapiclient.errors.HttpError as e:
+        # 404 means the start historyId has expired out of Gmail's history window.
+        if e.resp.status == 404:
+            return None
+        raise
+
+    data_dict = {'date': [], 'price': [], 'restaurant': []}
+    message_ids = []
+    fetched = list(_iter_messages_batched(service, added, scheduler=scheduler))
+    if scheduler.failed_throttled:
+        # The next refresh has to see these messages in the history again.
+        seen_ids.difference_update(msg["id"] for msg in added)
+        raise RateLimitedError(
+            f"Gmail kept rate-limiting {scheduler.failed_throttled} requests; try refreshing again in a minute."
+        )
+    # History lists oldest first; data_dict is newest first like messages.list.
+    for _, msg_details in reversed(fetched):
+        try:
+            if not msg_details or not _is_order_email(msg_details, sender_email, country):
+                continue
+            order = _parse_message(msg_details, country)
+        except Exception:
+            continue
+        if order is not None:
+            date, price, restaurant = order
+            data_dict['date'].append(date)
+            data_dict['price'].append(price)
+            data_dict['restaurant'].append(restaurant)
+            message_ids.append(msg_details["id"])
+    sync_state["history_id"] = history_id
+    if order_db is not None and sync_state.get("account"):
+        order_db.upsert(sync_state["account"], country, message_ids, data_dict)
+        order_db.save_cursor(sync_state["account"], country, history_id)
+    return data_dict
+
+
+GMAIL_API_ROOT = "https://gmail.googleapis.com/gmail/v1/users/me"
+# Not a FETCH_MODES entry: the async engine talks REST directly instead of going
+# through a googleapiclient service.
+ASYNC_FETCH_MODE = "async"
+DEFAULT_ASYNC_CONCURRENCY = 500
+
+
+async def _iter_message_ids_async(client, query, max_results=None, scheduler=None):
+    """Async counterpart of _iter_message_ids: yield message IDs page by page."""
+    scheduler = scheduler or QuotaScheduler()
+
+    async def list_page(params):
+        response = await client.get("/messages", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    listed = 0
+    page_token = None
+    while max_results is None or listed < max_results:
+        page_size = GMAIL_LIST_PAGE_SIZE if max_results is None else min(GMAIL_LIST_PAGE_SIZE, max_results - listed)
+        params = {"q": query, "maxResults": page_size}
+        if page_token:
+            params["pageToken"] = page_token
+        page = await scheduler.acall(lambda: list_page(params), GMAIL_QUOTA_UNITS["messages.list"])
+        messages = page.get("messages", [])[:page_size]
+        listed += len(messages)
+        for msg in messages:
+            yield msg["id"]
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return
 
+
+async def _fetch_orders_async(token, query, country, max_results, concurrency, api_root, transport, scheduler,
+                              cache, on_progress):
+    """List and download every matching message over one pooled async HTTP client.
+
+    Downloads start as soon as their listing page arrives. Returns a list with one
+    (date, price, restaurant) tuple or None per listed message, in list order.
+    `on_progress(done, listed, listing_done, order, wire_bytes, from_cache)` runs
+    as each message completes; `wire_bytes` is the (possibly gzipped) response
+    size. The semaphore caps requests in flight; `scheduler` keeps them under
+    quota. Messages `cache` already knows are not downloaded.
+    """
+    config = TRANSPORTS[transport]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(base_url=api_root, headers=headers, limits=limits, timeout=60) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        orders = []
+        done = 0
+        listing_done = False
+
+        async def get_json(path, params=None, headers=None):
+            response = await client.get(path, params=params, headers=headers)
+            response.raise_for_status()
+            return response
+
+        account = None
+        if cache is not None:
+            try:
+                profile = await scheduler.acall(lambda: get_json("/profile"), GMAIL_QUOTA_UNITS["getProfile"])
+                account = _account_key(profile.json())
+            except Exception:
+                # Without the mailbox address there's no safe cache key.
+                account = None
+
+        async def fetch_one(index, msg_id):
+            nonlocal done
+            async with semaphore:
+                wire_bytes = 0
+                try:
+                    response = await scheduler.acall(
+                        lambda: get_json(f"/messages/{msg_id}", config["params"], config["headers"]),
+                        GMAIL_QUOTA_UNITS["messages.get"],
+                    )
+                    wire_bytes = response.num_bytes_downloaded
+                    msg_details = response.json()
+                    date, decoded_content, truncated = _message_date_and_body(msg_details, _body_prefix_bytes(cache))
+                    decoded_content, order = _parse_decoded(msg_details, date, decoded_content, truncated, country)
+                    if account is not None:
+                        cache.put(account, msg_id, country, date, decoded_content, order)
+                except Exception:
+                    # One bad email shouldn't kill the whole batch.
+                    order = None
+            orders[index] = order
+            done += 1
+            on_progress(done, len(orders), listing_done, order, wire_bytes, False)
+
+        tasks = []
+        async for msg_id in _iter_message_ids_async(client, query, max_results, scheduler):
+            cached = cache.get(account, msg_id, country) if account is not None else CACHE_MISS
+            orders.append(None if cached is CACHE_MISS else cached)
+            if cached is CACHE_MISS:
+                tasks.append(asyncio.create_task(fetch_one(len(orders) - 1, msg_id)))
+            else:
+                done += 1
+                on_progress(done, len(orders), listing_done, cached, 0, True)
+        listing_done = True
+        await asyncio.gather(*tasks)
+        return orders
+
+
+def get_emails_async(token, sender_email, country="Pakistan", currency="PKR", days=365, max_results=None,
+                     concurrency=DEFAULT_ASYNC_CONCURRENCY, api_root=GMAIL_API_ROOT, transport=DEFAULT_TRANSPORT,
+                     fetch_stats=None, cache=None, scheduler=None):
+    """Fetch Foodpanda orders through the Gmail REST API with asyncio.
+
+    Alternative to get_emails_from_sender that keeps up to `concurrency` requests in
+    flight on a single connection pool. `api_root` can point at a local stand-in
+    server for benchmarking. Returns the same data_dict structure; `fetch_stats`
+    gets message and on-the-wire byte counts.
+    """
+    if scheduler is None:
+        # Start where the threaded engine does: at 5 units per messages.get, Gmail's
+        # per-user quota sustains about 50 gets a second, so opening at
+        # `concurrency` would just trip 429s. AIMD grows from here toward `concurrency`
+        # when the server keeps up (always, for an unlimited-quota stand-in).
+        scheduler = QuotaScheduler(initial_concurrency=DEFAULT_FETCH_WORKERS, max_concurrency=concurrency)
+    progress = ProgressReporter(currency, scheduler=scheduler)
+    counts = {"bytes": 0, "cache_hits": 0}
+
+    def on_progress(done, total_messages, listing_done, order, wire_bytes, from_cache):
+        counts["bytes"] += wire_bytes
+        counts["cache_hits"] += from_cache
+        progress.update(done, total_messages, listing_done, order)
+
+    query = _build_query(sender_email, country, days)
+    try:
+        orders = asyncio.run(_fetch_orders_async(
+            token, query, country, max_results, concurrency, api_root, transport, scheduler, cache, on_progress
+        ))
+        progress.finish()
+        if cache is not None:
+            cache.flush()
+        if fetch_stats is not None:
+            fetch_stats.update(
+                transport=transport, messages=len(orders) - counts["cache_hits"], bytes=counts["bytes"],
+                bytes_kind="on the wire",
+                cache_hits=counts["cache_hits"], progress_frames=progress.frames, **scheduler.stats(),
+            )
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
         return None
+    finally:
+        progress.clear()
+
+    if not orders:
+        st.warning(f"No emails found from {sender_email} in the last {days} days.")
+        return
+
+    data_dict = {'date': [], 'price': [], 'restaurant': []}
+    for order in orders:
+        if order is not None:
+            date, price, restaurant = order
+            data_dict['date'].append(date)
+            data_dict['price'].append(price)
+            data_dict['restaurant'].append(restaurant)
+    return data_dict
+
+def _orders_from_emails(emails, country):
+    """data_dict for (date, body) pairs read from an offline export."""
+    data_dict = {'date': [], 'price': [], 'restaurant': []}
+    for date, decoded_content in emails:
+        try:
+            order = _parse_body(date, decoded_content, country)
+        except Exception:
+            order = None
+        if order is not None:
+            data_dict['date'].append(order[0])
+            data_dict['price'].append(order[1])
+            data_dict['restaurant'].append(order[2])
+    return data_dict
+
+
+def _read_offline_export(read, path, country, workers, label):
+    """Run a takeout reader over `path` with a progress bar and parse what it finds."""
+    config = COUNTRIES[country]
+    progress = st.progress(0.0, f"Scanning {label}...")
+
+    def on_chunk(done, total):
+        progress.progress(done / total, f"Scanned {done} of {total} parts of the {label}")
+
+    try:
+        emails = read(path, [config["sender"]], order_subject=config.get("order_subject"), workers=workers,
+                      on_chunk=on_chunk)
+    finally:
+        progress.empty()
+    return _orders_from_emails(emails, country)
+
+
+def import_takeout_mbox(path, country="Pakistan", workers=None):
+    """Build the usual data_dict from a Google Takeout mbox export instead of the Gmail API.
+
+    takeout.read_order_emails finds the country's order emails with a process
+    pool over byte ranges of the file; they are parsed here exactly like
+    downloaded ones.
+    """
+    return _read_offline_export(takeout.read_order_emails, path, country, workers, "export")
+
+
+def import_email_directory(path, country="Pakistan", workers=None):
+    """Build the usual data_dict from a directory of .eml files or a Maildir tree.
+
+    A batch path for archived corpora: files are read and filtered by a process
+    pool, then parsed like downloaded emails. Not offered in the hosted UI, since
+    it reads from the server's filesystem.
+    """
+    return _read_offline_export(takeout.read_order_emails_from_directory, path, country, workers, "archive")
+
+
+# RFC 2822 as Gmail and mail clients write it, once any "(UTC)"-style comment is stripped.
+RFC2822_DATE_FORMAT = "%a, %d %b %Y %H:%M:%S %z"
+
+
+def _parse_date_strings(dates):
+    """datetime64[ns, UTC] for a Series of date strings, NaT where unparseable.
+
+    Tries vectorized strict formats first (RFC 2822 headers, then ISO 8601 as a
+    saved CSV holds them) and only falls back to email.utils per element for
+    whatever is left, instead of letting pandas infer a format element by element.
+    """
+    dates = dates.str.split(" (", n=1, regex=False).str[0].str.strip()
+    parsed = pd.to_datetime(dates, format=RFC2822_DATE_FORMAT, utc=True, errors="coerce")
+    for fallback in (
+        lambda left: pd.to_datetime(left, format="ISO8601", utc=True, errors="coerce"),
+        lambda left: pd.to_datetime(left.map(_parse_rfc2822_leniently), utc=True, errors="coerce"),
+    ):
+        missing = parsed.isna()
+        if not missing.any():
+            break
+        parsed[missing] = fallback(dates[missing])
+    return parsed
+
+
+def _parse_rfc2822_leniently(value):
+    try:
+        return email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def order_timestamps(dates):
+    """datetime64[ns, UTC] Series for order dates from any ingestion path.
+
+    Accepts Gmail internalDate epoch milliseconds (as ints or digit strings) and
+    date strings, mixed in one list or Series; unparseable dates become NaT.
+    """
+    dates = pd.Series(dates, dtype=object)
+    epoch_ms = pd.to_numeric(dates, errors="coerce")
+    numeric = epoch_ms.notna()
+    parsed = pd.Series(pd.NaT, index=dates.index, dtype="datetime64[ns, UTC]")
+    if numeric.any():
+        parsed[numeric] = pd.to_datetime(epoch_ms[numeric].astype("int64"), unit="ms", utc=True)
+    strings = ~numeric & dates.notna()
+    if strings.any():
+        parsed[strings] = _parse_date_strings(dates[strings].astype(str))
+    return parsed
+
+
+# Prices are kept as integer paisa/poisha in the session's order frame.
+MINOR_UNITS_PER_MAJOR = 100
+
+
+def orders_dataframe(orders, country):
+    """Compact order frame kept in session state, built from any ingestion path.
+
+    `orders` is a data_dict or a DataFrame with the same columns, e.g. a CSV
+    read, load_from_store or OrderDatabase.orders. `date` becomes datetime64 in
+    the country's local time, `price` int64 minor units and `restaurant` a
+    categorical, so a session holds a few bytes per order instead of a Python
+    string each. analysis_frame turns it back into prices for display.
+    """
+    df = pd.DataFrame(orders)[['date', 'price', 'restaurant']]
+    dates = df['date']
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        dates = dates if dates.dt.tz is not None else dates.dt.tz_localize('UTC')
+    else:
+        dates = order_timestamps(dates)
+    prices = pd.to_numeric(df['price'], errors='coerce').fillna(0)
+    return pd.DataFrame({
+        'date': dates.dt.tz_convert(COUNTRIES[country]["timezone"]),
+        'price': (prices * MINOR_UNITS_PER_MAJOR).round().astype('int64'),
+        'restaurant': df['restaurant'].astype('category'),
+    })
+
+
+def combine_orders(*frames):
+    """Concatenate orders_dataframe frames, keeping `restaurant` categorical."""
+    df = pd.concat(frames, ignore_index=True)
+    # Frames with different restaurant categories concatenate to object dtype.
+    df['restaurant'] = df['restaurant'].astype('category')
+    return df
+
+
+def analysis_frame(orders):
+    """Working copy of an orders_dataframe frame for display, with `price` in major units."""
+    return orders.assign(price=orders['price'] / MINOR_UNITS_PER_MAJOR)
+
 
 def save_to_csv(data_dict):
     """Save order data to a CSV file."""
@@ -303,19 +2140,166 @@ def load_from_csv():
         st.error(f"Error loading data: {str(e)}")
         return None
 
-def get_gmail_messages(credentials, country="Pakistan"):
+# Columnar order store: a directory of Arrow IPC files, one per save, so writes
+# only ever append. Files are uncompressed so reads can memory-map them.
+# Like save_to_csv and load_from_csv, the order store is deliberately not wired
+# into the app: sessions keep their orders in memory and opt-in persistence goes
+# through OrderDatabase. It is kept for self-hosted scripts (and `benchmark.py store`).
+ORDER_STORE_PATH = 'foodpanda_orders'
+ORDER_STORE_SCHEMA = pa.schema([
+    ('date', pa.timestamp('ns', tz='UTC')),
+    ('price', pa.float64()),
+    ('restaurant', pa.dictionary(pa.int32(), pa.string())),
+])
+
+
+def _orders_table(data_dict):
+    """data_dict (or an orders DataFrame) as an Arrow table in ORDER_STORE_SCHEMA."""
+    return pa.table({
+        'date': pa.array(order_timestamps(data_dict['date']), type=ORDER_STORE_SCHEMA.field('date').type),
+        'price': pa.array(pd.Series(data_dict['price'], dtype='float64')),
+        'restaurant': pa.array(pd.Series(data_dict['restaurant'], dtype=object)).dictionary_encode(),
+    }, schema=ORDER_STORE_SCHEMA)
+
+
+def _store_parts(path):
+    """The order store's files, oldest first."""
+    return sorted(glob.glob(os.path.join(path, '*.arrow')))
+
+
+def _epoch_ns(dates):
+    """An Arrow timestamp column as UTC epoch nanoseconds."""
+    return dates.cast(pa.int64())
+
+
+def _stored_max_date(path):
+    """Newest order date in the store at `path` as UTC epoch nanoseconds, or None if it is empty."""
+    part_maxes = [
+        pc.max(_epoch_ns(pa.ipc.open_file(pa.memory_map(part)).read_all().column('date'))).as_py()
+        for part in _store_parts(path)
+    ]
+    return max((m for m in part_maxes if m is not None), default=None)
+
+
+def save_to_store(data_dict, path=ORDER_STORE_PATH):
+    """Append orders newer than any already stored to the columnar order store at `path`; returns rows appended.
+
+    The store has no message IDs to key on, so saving a history that overlaps
+    the stored one appends only what came after it, and saving the same orders
+    twice appends nothing. Older orders can't be backfilled.
+    """
+    try:
+        table = _orders_table(data_dict)
+        newest = _stored_max_date(path)
+        if newest is not None:
+            table = table.filter(pc.greater(_epoch_ns(table.column('date')), newest))
+        if not table.num_rows:
+            return 0
+        os.makedirs(path, exist_ok=True)
+        part = os.path.join(path, f"orders-{time.time_ns()}.arrow")
+        # Written under a temporary name so readers never map a half-written file.
+        with pa.OSFile(part + '.tmp', 'wb') as sink, pa.ipc.new_file(sink, ORDER_STORE_SCHEMA) as writer:
+            writer.write_table(table)
+        os.replace(part + '.tmp', part)
+        st.success("✅ Order data saved successfully!")
+        return table.num_rows
+    except Exception as e:
+        st.error(f"Error saving data: {str(e)}")
+        return 0
+
+
+def load_from_store(path=ORDER_STORE_PATH, country=None):
+    """Load every stored order as a DataFrame, or None if there are none.
+
+    Columns come back typed (UTC timestamps, float prices, categorical
+    restaurants) straight from memory-mapped files, with no parsing. With a
+    `country`, dates are converted to its time zone like orders_dataframe does.
+    """
+    try:
+        parts = _store_parts(path)
+        if not parts:
+            return None
+        tables = [pa.ipc.open_file(pa.memory_map(part)).read_all() for part in parts]
+        df = pa.concat_tables(tables).to_pandas()
+        if country is not None:
+            df['date'] = df['date'].dt.tz_convert(COUNTRIES[country]["timezone"])
+        return df
+    except Exception as e:
+        st.error(f"Error loading data: {str(e)}")
+        return None
+
+
+def migrate_csv_to_store(csv_path='foodpanda_orders.csv', path=ORDER_STORE_PATH):
+    """Copy a save_to_csv file into the order store unless the store already has data; returns rows copied."""
+    if not os.path.exists(csv_path) or _store_parts(path):
+        return 0
+    return save_to_store(pd.read_csv(csv_path), path)
+
+
+def migrate_csv_to_database(order_db, account, country, csv_path='foodpanda_orders.csv'):
+    """Import a save_to_csv file into `order_db` for `account` and `country` unless one already was.
+
+    Returns rows imported. Run by an operator through migrate_orders.py, never
+    by the app: the CSV doesn't say which mailbox it came from.
+    """
+    if not os.path.exists(csv_path) or order_db.has_csv_orders(account, country):
+        return 0
+    return order_db.import_csv(csv_path, account, country)
+
+
+def _database_account(country):
+    """The order database and account to aggregate the current analysis from, or (None, None)."""
+    order_db = get_order_database()
+    sync_state = st.session_state.get('sync_state') or {}
+    if order_db is None or not sync_state.get('account') or sync_state.get('country') != country:
+        return None, None
+    return order_db, sync_state['account']
+
+
+def _stored_totals(country, df, totals):
+    """Run `totals` (OrderDatabase.monthly_totals or restaurant_totals) over the orders in `df`, or return None.
+
+    Only Gmail-fetched rows between df's first and last order are aggregated,
+    and if that window holds a different number of orders than df (say a
+    download that failed this time was stored by an earlier sync), None tells
+    the caller to aggregate df in pandas instead, so every tab shows one order set.
+    """
+    order_db, account = _database_account(country)
+    if order_db is None:
+        return None
+    result = totals(order_db, account, country, since=df['date'].min(), until=df['date'].max(), imported=False)
+    return result if result['orders'].sum() == len(df) else None
+
+
+def get_gmail_messages(credentials, country="Pakistan", fetch_mode=DEFAULT_FETCH_MODE, workers=DEFAULT_FETCH_WORKERS,
+                       max_results=None, transport=DEFAULT_TRANSPORT, use_cache=False, prefilter=False):
     """Fetch and analyze Foodpanda expenses from Gmail."""
     config = COUNTRIES[country]
     sender_email = config["sender"]
     currency = config["currency"]
-    service = googleapiclient.discovery.build("gmail", "v1", credentials=credentials)
 
     # Get expenses data
     data_dict = {'date': [], 'price': [], 'restaurant': []}
+    sync_state = {"country": country}
+    fetch_stats = {}
+    cache = get_message_cache() if use_cache else None
+    order_db = get_order_database()
     try:
-        service_results = get_emails_from_sender(
-            service, sender_email, country=country, currency=currency, days=days_to_analyze
-        )
+        service = get_gmail_service(credentials)
+        if fetch_mode == ASYNC_FETCH_MODE:
+            service_results = get_emails_async(
+                st.session_state["credentials"]["token"], sender_email,
+                country=country, currency=currency, days=days_to_analyze, max_results=max_results,
+                transport=transport, fetch_stats=fetch_stats, cache=cache,
+            )
+        else:
+            service_results = get_emails_from_sender(
+                service, sender_email, country=country, currency=currency, days=days_to_analyze,
+                max_results=max_results, fetch_mode=fetch_mode, workers=workers,
+                service_factory=lambda: build_gmail_service(credentials),
+                sync_state=sync_state, transport=transport, fetch_stats=fetch_stats, cache=cache,
+                prefilter=prefilter, order_db=order_db,
+            )
         if service_results:
             data_dict = service_results
     except Exception as e:
@@ -327,13 +2311,15 @@ def get_gmail_messages(credentials, country="Pakistan"):
         return
 
     # Convert to DataFrame and process dates
-    df = pd.DataFrame(data_dict)
-    df['date'] = pd.to_datetime(df['date'])
+    df = orders_dataframe(data_dict, country)
 
     # Store in session state so data persists across reruns
     st.session_state['analysis_data'] = df
     st.session_state['analysis_country'] = country
     st.session_state['analysis_currency'] = currency
+    st.session_state['sync_state'] = sync_state
+    st.session_state['fetch_stats'] = fetch_stats
+    df = analysis_frame(df)
     
     # Calculate date range for display
     latest_order = df['date'].max()
@@ -603,7 +2589,7 @@ def get_gmail_messages(credentials, country="Pakistan"):
         st.markdown("### Restaurant Analysis")
 
         # Overall top restaurants
-        restaurant_summary = df.groupby('restaurant').agg({
+        restaurant_summary = df.groupby('restaurant', observed=True).agg({
             'price': ['sum', 'count', 'mean']
         }).round(2)
         restaurant_summary.columns = ['Total Spent', 'Number of Orders', 'Average Order']
@@ -624,7 +2610,7 @@ def get_gmail_messages(credentials, country="Pakistan"):
         monthly_summary = []
         for month in months:
             month_data = df[df['month_year'] == month]
-            top_3 = month_data.groupby('restaurant').agg({
+            top_3 = month_data.groupby('restaurant', observed=True).agg({
                 'price': 'sum',
                 'restaurant': 'count'
             }).round(2)
@@ -649,6 +2635,54 @@ def get_gmail_messages(credentials, country="Pakistan"):
         monthly_summary_df = pd.DataFrame(monthly_summary)
         st.dataframe(monthly_summary_df, hide_index=True, use_container_width=True)
 
+def _stored_sync_state(service, order_db, country):
+    """A sync_state resuming from the cursor `order_db` saved for this mailbox, or None if there isn't one."""
+    if order_db is None:
+        return None
+    profile = _get_profile(service)
+    if profile is None:
+        return None
+    account = _account_key(profile)
+    history_id = order_db.cursor(account, country)
+    if history_id is None:
+        return None
+    return {"country": country, "account": account, "history_id": history_id, "message_ids": set()}
+
+def refresh_gmail_messages(credentials):
+    """Merge orders received since the last sync into the stored analysis.
+
+    Without a cursor in this session (e.g. after an async-mode analysis), the one
+    the order database saved for the mailbox is used, when there is one. Returns
+    the number of new orders, or None if there is no usable sync cursor and the
+    caller should fall back to a full analysis.
+    """
+    sync_state = st.session_state.get('sync_state')
+    country = st.session_state.get('analysis_country')
+    order_db = get_order_database()
+    service = get_gmail_service(credentials)
+    resumed = not sync_state or "history_id" not in sync_state or sync_state.get("country") != country
+    if resumed:
+        sync_state = _stored_sync_state(service, order_db, country)
+        if sync_state is None:
+            return None
+
+    new_data = sync_new_emails(service, sync_state, country=country, order_db=order_db)
+    if new_data is None:
+        return None
+
+    if resumed:
+        # The stored cursor goes with the stored orders, not with whatever is on
+        # screen, so rebuild the analysis from the database over the same window.
+        st.session_state['sync_state'] = sync_state
+        since = st.session_state['analysis_data']['date'].min()
+        st.session_state['analysis_data'] = orders_dataframe(
+            order_db.orders(sync_state["account"], country, since=since, imported=False), country
+        )
+    elif new_data['date']:
+        new_df = orders_dataframe(new_data, country)
+        st.session_state['analysis_data'] = combine_orders(new_df, st.session_state['analysis_data'])
+    return len(new_data['date'])
+
 def generate_insights(df, total_spent, total_orders, avg_order, country="Pakistan"):
     """Generate intelligent insights from the order data."""
     config = COUNTRIES[country]
@@ -659,7 +2693,7 @@ def generate_insights(df, total_spent, total_orders, avg_order, country="Pakista
     
     # Insight 1: Top 3 Restaurants
     if not df.empty:
-        top_restaurants = df.groupby('restaurant')['restaurant'].count().sort_values(ascending=False).head(3)
+        top_restaurants = df.groupby('restaurant', observed=True)['restaurant'].count().sort_values(ascending=False).head(3)
         
         # Format top 3 restaurants
         top_3_text = []
@@ -785,7 +2819,7 @@ def generate_insights(df, total_spent, total_orders, avg_order, country="Pakista
     for period in ['Morning', 'Afternoon', 'Evening', 'Late Night']:
         period_df = df_time[df_time['time_period'] == period]
         if not period_df.empty:
-            top_rest = period_df.groupby('restaurant').size().sort_values(ascending=False)
+            top_rest = period_df.groupby('restaurant', observed=True).size().sort_values(ascending=False)
             if len(top_rest) > 0:
                 restaurant = top_rest.index[0]
                 count = int(top_rest.iloc[0])
@@ -806,7 +2840,7 @@ def display_hero_section(df, currency="PKR"):
         return
     
     # Calculate favorite restaurant stats
-    restaurant_stats = df.groupby('restaurant').agg({
+    restaurant_stats = df.groupby('restaurant', observed=True).agg({
         'price': ['sum', 'count']
     }).round(2)
     restaurant_stats.columns = ['total_spent', 'order_count']
@@ -1718,8 +3752,12 @@ else:  # Home page
             if isinstance(auth_code, list):
                 auth_code = auth_code[0]
             tokens = exchange_code_for_tokens(auth_code)
+            # google-auth wants a naive UTC expiry; without one it never sees the token as expired.
+            expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + \
+                datetime.timedelta(seconds=tokens.get("expires_in", 3600))
             st.session_state["credentials"] = {
                 "token": tokens["access_token"],
+                "expiry": expiry,
                 "refresh_token": tokens.get("refresh_token"),
                 "token_uri": TOKEN_URL,
                 "client_id": CLIENT_ID,
@@ -1739,8 +3777,10 @@ else:  # Home page
         # Check if we already have analysis data
         if 'analysis_data' in st.session_state and st.session_state['analysis_data'] is not None:
             # Display the analysis from stored data
-            df = st.session_state['analysis_data']
+            df = analysis_frame(st.session_state['analysis_data'])
             country = st.session_state.get('analysis_country', 'Pakistan')
+            if 'sync_notice' in st.session_state:
+                st.toast(st.session_state.pop('sync_notice'))
             currency = st.session_state.get('analysis_currency', 'PKR')
 
             # Calculate date range for display
@@ -1847,9 +3887,14 @@ else:  # Home page
 
             with tab1:
                 st.markdown("### Monthly Spending Trend")
-                monthly_data = df.groupby(df['date'].dt.to_period('M')).agg({'price': 'sum'}).reset_index()
-                monthly_data['date'] = monthly_data['date'].dt.to_timestamp()
-                monthly_data = monthly_data.sort_values('date')
+                # Aggregated in SQL when the order database holds this analysis, so it never has to fit in pandas.
+                totals = _stored_totals(country, df, OrderDatabase.monthly_totals)
+                if totals is not None:
+                    monthly_data = pd.DataFrame({'date': pd.to_datetime(totals['month']), 'price': totals['total']})
+                else:
+                    monthly_data = df.groupby(df['date'].dt.to_period('M')).agg({'price': 'sum'}).reset_index()
+                    monthly_data['date'] = monthly_data['date'].dt.to_timestamp()
+                    monthly_data = monthly_data.sort_values('date')
                 fig = create_monthly_spending_chart(monthly_data, 0, currency)
                 st.plotly_chart(fig, use_container_width=True)
             
@@ -1979,7 +4024,11 @@ else:  # Home page
             
             with tab3:
                 st.markdown("### Restaurant Analysis")
-                restaurant_summary = df.groupby('restaurant').agg({'price': ['sum', 'count', 'mean']}).round(2)
+                restaurant_summary = _stored_totals(country, df, OrderDatabase.restaurant_totals)
+                if restaurant_summary is not None:
+                    restaurant_summary = restaurant_summary.set_index('restaurant').round(2)
+                else:
+                    restaurant_summary = df.groupby('restaurant', observed=True).agg({'price': ['sum', 'count', 'mean']}).round(2)
                 restaurant_summary.columns = ['Total Spent', 'Number of Orders', 'Average Order']
                 restaurant_summary = restaurant_summary.sort_values('Number of Orders', ascending=False)
                 
@@ -1995,7 +4044,7 @@ else:  # Home page
                 monthly_summary = []
                 for month in months:
                     month_data = df_copy[df_copy['month_year'] == month]
-                    top_3 = month_data.groupby('restaurant').agg({'price': 'sum', 'restaurant': 'count'}).round(2)
+                    top_3 = month_data.groupby('restaurant', observed=True).agg({'price': 'sum', 'restaurant': 'count'}).round(2)
                     top_3.columns = ['Total Spent', 'Orders']
                     top_3 = top_3.sort_values('Total Spent', ascending=False).head(3)
                     
@@ -2010,19 +4059,73 @@ else:  # Home page
             
             # Add button to refresh data
             st.markdown("---")
-            col1, col2 = st.columns(2)
+            fetch_stats = st.session_state.get('fetch_stats')
+            if fetch_stats:
+                per_email_kb = fetch_stats['bytes'] / max(fetch_stats['messages'], 1) / 1024
+                st.caption(
+                    f"📶 Last fetch: {fetch_stats['messages']:,} emails downloaded, "
+                    f"{fetch_stats.get('cache_hits', 0):,} reused from cache · {fetch_stats['bytes'] / 1024 / 1024:,.2f} MB "
+                    f"{fetch_stats.get('bytes_kind', 'of decoded JSON')} "
+                    f"· {per_email_kb:,.1f} KB per email ({fetch_stats['transport']} transport) "
+                    f"· {fetch_stats.get('quota_units', 0):,} quota units · {fetch_stats.get('throttled', 0)} throttled"
+                )
+                if fetch_stats.get('failed_throttled'):
+                    st.warning(
+                        f"⚠️ Gmail kept rate-limiting {fetch_stats['failed_throttled']:,} requests until the time "
+                        f"limit ran out, so some orders may be missing. Use Full Re-sync to fetch them again."
+                    )
+                if fetch_stats.get('metadata_fetched'):
+                    st.caption(
+                        f"🔎 Screened {fetch_stats['metadata_fetched']:,} emails by subject and snippet "
+                        f"({fetch_stats['metadata_bytes'] / 1024 / 1024:,.2f} MB of decoded JSON) · "
+                        f"{fetch_stats['downloads_avoided']:,} non-receipt downloads avoided"
+                    )
+                queue_depths = fetch_stats.get('queue_depths')
+                if queue_depths:
+                    st.caption("🧵 Peak backlog per stage: " + " · ".join(
+                        f"{stage} {depth['peak']} (avg {depth['mean']:.1f})" for stage, depth in queue_depths.items()
+                    ))
+            col1, col2, col3 = st.columns(3)
             with col1:
-                if st.button("🔄 Refresh Data", type="secondary"):
+                if st.button("🔄 Refresh Data", type="secondary", help="Fetch only orders received since the last sync."):
+                    try:
+                        with st.spinner("Checking Gmail for new orders..."):
+                            new_orders = refresh_gmail_messages(credentials)
+                    except RateLimitedError as e:
+                        # Nothing was merged and the cursor didn't move, so the analysis on screen still stands.
+                        st.session_state['sync_notice'] = f"⚠️ {e}"
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"An error occurred: {str(e)}")
+                        new_orders = None
+                    if new_orders is None:
+                        # No usable cursor: start over with a full analysis.
+                        st.session_state['analysis_data'] = None
+                        st.session_state.pop('analysis_country', None)
+                        st.session_state.pop('analysis_currency', None)
+                        st.session_state.pop('sync_state', None)
+                        st.session_state.pop('fetch_stats', None)
+                    else:
+                        # Shown after the rerun, once the merged analysis is on screen.
+                        st.session_state['sync_notice'] = f"Found {new_orders} new order{'s' if new_orders != 1 else ''}"
+                    st.rerun()
+            with col2:
+                if st.button("♻️ Full Re-sync", type="secondary", help="Discard the current analysis and re-download everything."):
                     st.session_state['analysis_data'] = None
                     st.session_state.pop('analysis_country', None)
                     st.session_state.pop('analysis_currency', None)
+                    st.session_state.pop('sync_state', None)
+                    st.session_state.pop('fetch_stats', None)
                     st.rerun()
-            with col2:
+            with col3:
                 if st.button("🔓 Disconnect Gmail", type="secondary"):
                     st.session_state['analysis_data'] = None
                     st.session_state.pop('analysis_country', None)
                     st.session_state.pop('analysis_currency', None)
-                    del st.session_state["credentials"]
+                    st.session_state.pop('sync_state', None)
+                    st.session_state.pop('fetch_stats', None)
+                    st.session_state.pop("credentials")
+                    forget_gmail_service()
                     st.rerun()
         else:
             # No analysis data yet, show the analyze button
@@ -2036,13 +4139,52 @@ else:  # Home page
 
             days_to_analyze = st.slider("Select days to analyze", 30, 365, 365)
 
+            with st.expander("⚙️ Advanced"):
+                fetch_mode = st.selectbox(
+                    "Fetch mode",
+                    [*FETCH_MODES, ASYNC_FETCH_MODE],
+                    help="How receipts are downloaded from Gmail. 'batch' bundles up to 100 emails per request, "
+                         "'threaded' downloads several emails in parallel, 'async' keeps hundreds of "
+                         "REST requests in flight at once.",
+                )
+                fetch_workers = st.slider(
+                    "Parallel downloads", 1, 32, DEFAULT_FETCH_WORKERS,
+                    help="Worker threads used by the 'threaded' fetch mode.",
+                )
+                max_emails = st.number_input(
+                    "Max emails to scan (0 = no limit)", min_value=0, value=0, step=100,
+                    help="Only look at the newest N matching emails.",
+                )
+                transport = st.radio(
+                    "Transport", list(TRANSPORTS), index=list(TRANSPORTS).index(DEFAULT_TRANSPORT), horizontal=True,
+                    help="'lean' downloads only the fields the parser needs. 'raw' downloads each email's "
+                         "original source and parses it locally. All transports are gzip-compressed.",
+                )
+                # Only offered on self-hosted installs that keep a cache file.
+                use_cache = get_message_cache() is not None and st.checkbox(
+                    "Reuse previously parsed emails", value=False,
+                    help="Skip downloading emails this server has already parsed for your account. "
+                         "Parsed orders are kept in this server's cache file after your session ends.",
+                )
+                prefilter = st.checkbox(
+                    "Skip promos before downloading", value=False,
+                    help="Check each email's subject and preview first and only download likely receipts. "
+                         "Saves bandwidth when your inbox has many Foodpanda promos, but costs extra Gmail quota. "
+                         "Not used by the 'async' fetch mode.",
+                )
+
             if st.button("📊 Analyze My Food Expenses", type="primary"):
                 with st.spinner(f"Analyzing your FoodPanda orders from the last {days_to_analyze} days..."):
-                    get_gmail_messages(credentials, country=selected_country)
+                    get_gmail_messages(
+                        credentials, country=selected_country, fetch_mode=fetch_mode, workers=fetch_workers,
+                        max_results=int(max_emails) or None, transport=transport, use_cache=use_cache,
+                        prefilter=prefilter,
+                    )
                     st.rerun()
 
             if st.button("🔓 Disconnect Gmail", type="secondary"):
-                del st.session_state["credentials"]
+                st.session_state.pop("credentials")
+                forget_gmail_service()
                 st.rerun()
 
     else:
@@ -2070,12 +4212,52 @@ else:  # Home page
         This app only reads your FoodPanda order confirmation emails. No data is stored or shared.
         """)
 
+        with st.expander("📦 No Gmail access? Import a Google Takeout export"):
+            st.markdown(
+                "Export your mail from [Google Takeout](https://takeout.google.com/) (Mail, MBOX format), "
+                "unzip it and upload the `.mbox` file. It is only read on this server and deleted right after."
+            )
+            takeout_country = st.selectbox(
+                "Select your FoodPanda country",
+                list(COUNTRIES),
+                format_func=lambda name: f"{COUNTRIES[name]['flag']} {name}",
+                key="takeout_country",
+            )
+            mbox_file = st.file_uploader("Takeout mbox file", type=["mbox"])
+            if mbox_file is not None and st.button("📥 Import Orders", type="primary"):
+                try:
+                    with tempfile.NamedTemporaryFile(suffix=".mbox") as tmp:
+                        # The export is memory-mapped, so it has to be a real file on disk.
+                        shutil.copyfileobj(mbox_file, tmp, length=16 * 1024 * 1024)
+                        tmp.flush()
+                        with st.spinner("Importing your FoodPanda orders..."):
+                            takeout_data = import_takeout_mbox(tmp.name, country=takeout_country)
+                    if takeout_data['date']:
+                        takeout_df = orders_dataframe(takeout_data, takeout_country)
+                        st.session_state['takeout_data'] = takeout_df
+                    else:
+                        st.warning("📭 No Foodpanda orders found in this export.")
+                except Exception as e:
+                    st.error(f"Error importing export: {str(e)}")
+
+        if st.session_state.get('takeout_data') is not None:
+            takeout_df = analysis_frame(st.session_state['takeout_data'])
+            st.markdown("## 📊 Analysis Results")
+            st.markdown(
+                f"### 📅 Period: {takeout_df['date'].min().strftime('%B %d, %Y')} - "
+                f"{takeout_df['date'].max().strftime('%B %d, %Y')}"
+            )
+            display_analysis(takeout_df)
+            if st.button("🗑️ Clear Imported Data", type="secondary"):
+                st.session_state['takeout_data'] = None
+                st.rerun()
+
         # Preview section at the bottom
         with st.expander("👀 Preview Sample Analysis", expanded=True):
             try:
                 # Load sample data from CSV
-                preview_df = pd.read_csv('preview_sample.csv')
-                preview_df['date'] = pd.to_datetime(preview_df['date'])
+                # The sample is a Pakistan order history.
+                preview_df = analysis_frame(orders_dataframe(pd.read_csv('preview_sample.csv'), "Pakistan"))
                 
                 # Calculate date range
                 latest_order = preview_df['date'].max()
@@ -2097,7 +4279,7 @@ else:  # Home page
                 
                 with tab_rest1:
                     # Overall top restaurants
-                    restaurant_summary = preview_df.groupby('restaurant').agg({
+                    restaurant_summary = preview_df.groupby('restaurant', observed=True).agg({
                         'price': ['sum', 'count', 'mean']
                     }).round(2)
                     restaurant_summary.columns = ['Total Spent', 'Number of Orders', 'Average Order']
@@ -2120,7 +4302,7 @@ else:  # Home page
                     monthly_summary = []
                     for month in months:
                         month_data = preview_df[preview_df['month_year'] == month]
-                        top_3 = month_data.groupby('restaurant').agg({
+                        top_3 = month_data.groupby('restaurant', observed=True).agg({
                             'price': 'sum',
                             'restaurant': 'count'
                         }).round(2)
@@ -0,0 +1,501 @@
+"""Offline benchmarks for the tracker's Gmail ingestion.
+
+Runs against fake_gmail's local stand-in, so no Google account or network is
+needed. Importing app executes the Streamlit script in bare mode, so the same
+.streamlit/secrets.toml the app uses must be present.
+
+    python benchmark.py fetch --messages 2000 --latency 0.05
+    python benchmark.py takeout --messages 2000 --filler 20000
+    python benchmark.py eml --path ~/Maildir
+    python benchmark.py parse --country Bangladesh --html-only 0.5
+    python benchmark.py decode --footer-lines 2000
+    python benchmark.py html --country Bangladesh
+    python benchmark.py transport --html-only 0.5
+    python benchmark.py store --orders 200000
+    python benchmark.py frame --orders 200000
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+import streamlit.logger
+
+# Bare-mode Streamlit warns on every widget call; keep the tables readable.
+streamlit.logger.set_log_level("error")
+warnings.filterwarnings("ignore", category=UserWarning)
+
+import app  # noqa: E402
+import fake_gmail  # noqa: E402
+import htmltext  # noqa: E402
+import takeout  # noqa: E402
+
+
+def _scheduler(args, concurrency):
+    # The client paces itself to the stand-in's quota, or not at all when it has none.
+    quota = args.quota or float("inf")
+    return app.QuotaScheduler(quota_per_second=quota, initial_concurrency=concurrency, max_concurrency=concurrency,
+                              base_delay=0.05, max_delay=2.0)
+
+
+# Spawned takeout workers would re-import this script, and with it the whole app.
+takeout.WORKER_START_METHOD = "fork"
+
+
+def _print_table(rows, columns):
+    widths = [max(len(str(c)), *(len(str(r[i])) for r in rows)) for i, c in enumerate(columns)]
+    print("  ".join(str(c).ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)))
+
+
+def _peak_queues(stats):
+    depths = stats.get("queue_depths")
+    if not depths:
+        return "-"
+    return "/".join(str(depth["peak"]) for depth in depths.values())
+
+
+def bench_fetch(args):
+    corpus = fake_gmail.synthetic_corpus(args.messages, country=args.country, receipt_ratio=args.receipt_ratio,
+                                         seed=args.seed)
+    sender = app.COUNTRIES[args.country]["sender"]
+    columns = ["mode", "seconds", "emails/s", "orders", "MB*", "downloads avoided", "quota units", "throttled",
+               "retries", "gave up", "server calls", "peak queues", "progress frames"]
+    runs = [(mode, False) for mode in args.modes]
+    if args.prefilter:
+        runs += [(mode, True) for mode in args.modes if mode != app.ASYNC_FETCH_MODE]
+    rows = []
+    for mode, prefilter in runs:
+        backend = fake_gmail.FakeGmailBackend(corpus, latency=args.latency, jitter=args.jitter,
+                                              error_rate=args.error_rate, quota_per_second=args.quota or None,
+                                              seed=args.seed)
+        stats = {}
+        started = time.perf_counter()
+        if mode == app.ASYNC_FETCH_MODE:
+            server, api_root = fake_gmail.serve(backend)
+            try:
+                data = app.get_emails_async("offline", sender, country=args.country, api_root=api_root,
+                                            concurrency=args.concurrency, fetch_stats=stats,
+                                            scheduler=_scheduler(args, args.concurrency))
+            finally:
+                server.shutdown()
+        else:
+            concurrency = args.workers if mode == "threaded" else 1
+            data = app.get_emails_from_sender(
+                fake_gmail.FakeGmailService(backend), sender, country=args.country, fetch_mode=mode,
+                workers=args.workers, service_factory=lambda: fake_gmail.FakeGmailService(backend),
+                fetch_stats=stats, scheduler=_scheduler(args, max(concurrency, args.list_shards)),
+                list_shards=args.list_shards, prefilter=prefilter,
+            )
+        elapsed = time.perf_counter() - started
+        orders = len(data["price"]) if data else 0
+        downloaded = stats.get("bytes", 0) + stats.get("metadata_bytes", 0)
+        rows.append([f"{mode}+prefilter" if prefilter else mode, f"{elapsed:.2f}", f"{args.messages / elapsed:,.0f}",
+                     orders, f"{downloaded / 1024 / 1024:,.2f}", stats.get("downloads_avoided", 0),
+                     stats.get("quota_units", 0), stats.get("throttled", 0), stats.get("retries", 0),
+                     stats.get("failed_throttled", 0),
+                     sum(backend.calls.values()), _peak_queues(stats), stats.get("progress_frames", 0)])
+    _print_table(rows, columns)
+    print("* MB of decoded JSON, except async, which counts gzipped bytes on the wire")
+
+
+def bench_takeout(args):
+    corpus = fake_gmail.synthetic_corpus(args.messages, country=args.country, seed=args.seed)
+    config = app.COUNTRIES[args.country]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "All mail Including Spam and Trash.mbox")
+        fake_gmail.write_mbox(corpus, path, filler_messages=args.filler, filler_bytes=args.filler_bytes, seed=args.seed)
+        size = os.path.getsize(path)
+        # Scale the chunk size down with the file so the pool is exercised at any --filler.
+        takeout.MIN_CHUNK_BYTES = min(takeout.MIN_CHUNK_BYTES, max(1, size // (max(args.workers) * 4)))
+        rows = []
+        for workers in args.workers:
+            started = time.perf_counter()
+            emails = takeout.read_order_emails(path, [config["sender"]], order_subject=config.get("order_subject"),
+                                               workers=workers)
+            elapsed = time.perf_counter() - started
+            orders = sum(app._parse_body(date, body, args.country) is not None for date, body in emails)
+            rows.append([workers, f"{size / 1024 / 1024:,.0f}", f"{elapsed:.2f}",
+                         f"{size / 1024 / 1024 / elapsed:,.0f}", len(emails), orders])
+    _print_table(rows, ["workers", "MB", "seconds", "MB/s", "order emails", "orders"])
+
+
+def bench_eml(args):
+    config = app.COUNTRIES[args.country]
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.path
+        if root is None:
+            root = os.path.join(tmp, "Maildir")
+            corpus = fake_gmail.synthetic_corpus(args.messages, country=args.country, seed=args.seed)
+            fake_gmail.write_maildir(corpus, root)
+        files = sum(1 for _ in takeout.iter_message_files(root))
+        rows = []
+        for workers in args.workers:
+            started = time.perf_counter()
+            emails = takeout.read_order_emails_from_directory(root, [config["sender"]],
+                                                              order_subject=config.get("order_subject"),
+                                                              workers=workers)
+            data = app._orders_from_emails(emails, args.country)
+            elapsed = time.perf_counter() - started
+            rows.append([workers, files, f"{elapsed:.2f}", f"{files / elapsed:,.0f}", len(emails),
+                         len(data["price"])])
+    _print_table(rows, ["workers", "files", "seconds", "files/s", "order emails", "orders"])
+
+
+def _legacy_parse_order_email(decoded_content, country):
+    """parse_order_email as it was before the RECEIPT_PARSERS registry, kept for comparison."""
+    for marker in ("---------- Forwarded message ---------", "---------- Forwarded message ----------",
+                   "Begin forwarded message:"):
+        idx = decoded_content.find(marker)
+        if idx != -1:
+            decoded_content = decoded_content[idx + len(marker):]
+            break
+    if country == "Bangladesh":
+        try:
+            price_str = decoded_content.split('Order Total')[1].split('Tk')[1].split('\n')[0].strip()
+            price_match = re.search(r'([\d,]+\.?\d*)', price_str)
+            price = float(price_match.group(1).replace(',', '')) if price_match else 0
+        except Exception:
+            price = 0
+        match = re.search(r'Store\s+([^\n<]+)', decoded_content)
+        return price, match.group(1).strip() if match else "Panda Mart"
+
+    try:
+        price_str = decoded_content.split('Total')[1].split('PKR')[1].split('\n')[0].strip()
+    except Exception:
+        try:
+            price_str = decoded_content.split('Received')[1].split('Rs.')[1].split('\n')[0].strip()
+        except Exception:
+            price_str = ""
+    try:
+        price = float(price_str.replace(',', ''))
+    except Exception:
+        price = 0
+    match = re.search(r'Partner:\s*Name:\s*(.+)', decoded_content)
+    return price, match.group(1).strip() if match else "Panda Mart"
+
+
+def _corpus_bodies(args):
+    corpus = fake_gmail.synthetic_corpus(args.messages, country=args.country, html_only_ratio=args.html_only,
+                                         seed=args.seed)
+    return [app._extract_text_body(message["payload"]) for message in corpus]
+
+
+def _time_per_body(fn, bodies, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for body in bodies:
+            fn(body)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_parse(args):
+    bodies = _corpus_bodies(args)
+    parsers = {
+        "legacy split chain": lambda body: _legacy_parse_order_email(body, args.country),
+        "parse_order_email": lambda body: app.parse_order_email(body, args.country),
+    }
+    baseline = [_legacy_parse_order_email(body, args.country) for body in bodies]
+    rows = []
+    for name, fn in parsers.items():
+        elapsed = _time_per_body(fn, bodies, args.repeat)
+        mismatches = sum(fn(body) != expected for body, expected in zip(bodies, baseline))
+        rows.append([name, len(bodies), f"{elapsed * 1000:.1f}", f"{len(bodies) / elapsed:,.0f}", mismatches])
+
+    elapsed = _time_per_body(lambda batch: app.parse_order_emails(batch, args.country), [bodies], args.repeat)
+    batch = app.parse_order_emails(bodies, args.country)
+    mismatches = sum(row != expected for row, expected in zip(zip(batch["price"], batch["restaurant"]), baseline))
+    rows.append(["parse_order_emails (batch)", len(bodies), f"{elapsed * 1000:.1f}", f"{len(bodies) / elapsed:,.0f}",
+                 mismatches])
+    _print_table(rows, ["parser", "bodies", "ms", "bodies/s", "differs from legacy"])
+
+
+def _legacy_extract_text_body(payload):
+    """_extract_text_body as it was before the iterative walk and prefix decoding, kept for comparison."""
+    plain_b64 = None
+    html_b64 = None
+
+    def walk(node):
+        nonlocal plain_b64, html_b64
+        mime = node.get("mimeType", "")
+        data = (node.get("body") or {}).get("data")
+        if mime == "text/plain" and data and plain_b64 is None:
+            plain_b64 = data
+        elif mime == "text/html" and data and html_b64 is None:
+            html_b64 = data
+        for child in node.get("parts") or []:
+            walk(child)
+
+    walk(payload)
+    chosen = plain_b64 or html_b64
+    if not chosen:
+        return ""
+    try:
+        return base64.urlsafe_b64decode(chosen).decode("utf-8", errors="replace")
+    except Exception:
+        return ""
+
+
+def bench_decode(args):
+    corpus = fake_gmail.synthetic_corpus(args.messages, country=args.country, html_only_ratio=args.html_only,
+                                         footer_lines=args.footer_lines, seed=args.seed)
+
+    def legacy(message):
+        # Dated the way _message_date_and_body dates orders, so only the decoding is compared.
+        date = int(message["internalDate"])
+        return app._parse_body(date, _legacy_extract_text_body(message["payload"]), args.country)
+
+    decoders = {
+        "full decode (legacy)": legacy,
+        "full decode": lambda message: app._parse_body(*app._message_date_and_body(message)[:2], args.country),
+        f"prefix decode ({app.BODY_PREFIX_BYTES // 1024} KiB)": lambda message: app._parse_message(message,
+                                                                                                 args.country),
+    }
+    body_bytes = sum(len(_legacy_extract_text_body(message["payload"]).encode("utf-8")) for message in corpus)
+    baseline = [legacy(message) for message in corpus]
+    rows = []
+    for name, fn in decoders.items():
+        elapsed = _time_per_body(fn, corpus, args.repeat)
+        mismatches = sum(fn(message) != expected for message, expected in zip(corpus, baseline))
+        rows.append([name, len(corpus), f"{elapsed * 1000:.1f}", f"{len(corpus) / elapsed:,.0f}",
+                     f"{body_bytes / elapsed / 1e6:,.0f}", mismatches])
+    _print_table(rows, ["decoder", "messages", "ms", "messages/s", "body MB/s", "differs from legacy"])
+
+
+def bench_html(args):
+    corpus = fake_gmail.synthetic_corpus(args.messages, country=args.country, receipt_ratio=1.0, html_only_ratio=1.0,
+                                         footer_lines=args.footer_lines, seed=args.seed)
+    markups = [_legacy_extract_text_body(message["payload"]) for message in corpus]
+    texts = [htmltext.html_to_text(markup) for markup in markups]
+    markup_bytes = sum(len(markup.encode("utf-8")) for markup in markups)
+    text_bytes = sum(len(text.encode("utf-8")) for text in texts)
+    print(f"{len(markups)} HTML-only receipts, {markup_bytes / 1e6:,.1f} MB of markup -> "
+          f"{text_bytes / 1e6:,.2f} MB of text ({markup_bytes / text_bytes:,.0f}x smaller)")
+
+    baseline = [app.parse_order_email(markup, args.country) for markup in markups]
+    stages = {
+        "parse markup": lambda markup: app.parse_order_email(markup, args.country),
+        "html_to_text": htmltext.html_to_text,
+        "html_to_text + parse": lambda markup: app.parse_order_email(htmltext.html_to_text(markup), args.country),
+    }
+    rows = []
+    for name, fn in stages.items():
+        elapsed = _time_per_body(fn, markups, args.repeat)
+        rows.append([name, len(markups), f"{elapsed * 1000:.1f}", f"{len(markups) / elapsed:,.0f}",
+                     f"{markup_bytes / elapsed / 1e6:,.1f}"])
+    _print_table(rows, ["stage", "bodies", "ms", "bodies/s", "markup MB/s"])
+    unpriced = sum(not price for price, _ in baseline)
+    changed = sum(app.parse_order_email(text, args.country) != expected for text, expected in zip(texts, baseline))
+    print(f"orders differing from parsing the markup: {changed} (markup parse found no price for {unpriced})")
+
+
+def bench_transport(args):
+    corpus = fake_gmail.synthetic_corpus(args.messages, country=args.country, html_only_ratio=args.html_only,
+                                         footer_lines=args.footer_lines, seed=args.seed)
+    backend = fake_gmail.FakeGmailBackend(corpus)
+    formats = {"json (full/lean)": "full", "raw": "raw"}
+
+    def decode_and_parse(response):
+        message = json.loads(response)
+        date, body, _ = app._message_date_and_body(message)
+        return app._parse_body(date, body, args.country)
+
+    baseline = None
+    rows = []
+    for name, fmt in formats.items():
+        responses = [json.dumps(backend.get_message(message["id"], format=fmt), separators=(",", ":")).encode()
+                     for message in corpus]
+        wire_bytes = sum(len(response) for response in responses)
+        gzip_bytes = sum(len(gzip.compress(response, compresslevel=6)) for response in responses)
+        cpu = float("inf")
+        for _ in range(args.repeat):
+            started = time.process_time()
+            orders = [decode_and_parse(response) for response in responses]
+            cpu = min(cpu, time.process_time() - started)
+        # Messages are decoded one at a time, so the peak is the largest single message's working set.
+        tracemalloc.start()
+        for response in responses:
+            decode_and_parse(response)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        baseline = baseline or orders
+        mismatches = sum(order != expected for order, expected in zip(orders, baseline))
+        rows.append([name, len(responses), f"{wire_bytes / len(responses) / 1024:,.1f}",
+                     f"{gzip_bytes / len(responses) / 1024:,.1f}", f"{cpu / len(responses) * 1e6:,.0f}",
+                     f"{peak / 1024:,.0f}", mismatches])
+    _print_table(rows, ["format", "messages", "KB/msg", "gzip KB/msg", "CPU us/msg", "peak KB", "differs from json"])
+
+
+def _order_history(args):
+    """--orders rows resampled from the preview sample, spread over --restaurants branches per name."""
+    rng = random.Random(args.seed)
+    sample = pd.read_csv("preview_sample.csv")
+    history = sample.sample(args.orders, replace=True, random_state=args.seed, ignore_index=True)
+    history["restaurant"] = [f"{name} #{rng.randrange(args.restaurants)}" for name in history["restaurant"]]
+    return history
+
+
+def bench_store(args):
+    history = _order_history(args)
+    # save_to_store only appends orders newer than the stored ones, so resampled
+    # repeats get their own millisecond, oldest first.
+    dates = app.order_timestamps(history["date"]).sort_values()
+    history = history.loc[dates.index].assign(date=dates + pd.to_timedelta(np.arange(len(dates)), unit="ms"))
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "foodpanda_orders.csv")
+        store_path = os.path.join(tmp, "foodpanda_orders")
+        history.to_csv(csv_path, index=False)
+        # Saved in --appends batches, the way repeated syncs would grow the store.
+        bounds = np.linspace(0, len(history), args.appends + 1).astype(int)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            app.save_to_store(history.iloc[start:end], store_path)
+        store_bytes = sum(os.path.getsize(os.path.join(store_path, name)) for name in os.listdir(store_path))
+        loaders = {
+            "read_csv + orders_dataframe": lambda: app.orders_dataframe(pd.read_csv(csv_path), args.country),
+            "load_from_store": lambda: app.load_from_store(store_path, country=args.country),
+        }
+        rows = []
+        for name, load in loaders.items():
+            elapsed = _time_per_body(lambda _: load(), [None], args.repeat)
+            frame = load()
+            rows.append([name, len(frame), f"{elapsed * 1000:,.1f}",
+                         f"{frame.memory_usage(deep=True).sum() / 1024 / 1024:,.1f}"])
+        print(f"CSV {os.path.getsize(csv_path) / 1024 / 1024:,.1f} MB, store {store_bytes / 1024 / 1024:,.1f} MB "
+              f"in {args.appends} files")
+    _print_table(rows, ["loader", "orders", "ms", "frame MB"])
+
+
+def _legacy_orders_dataframe(data, country):
+    df = pd.DataFrame(data)
+    df["date"] = app.order_timestamps(df["date"]).dt.tz_convert(app.COUNTRIES[country]["timezone"])
+    return df
+
+
+def bench_frame(args):
+    history = _order_history(args)
+    frames = {
+        "object + float64": _legacy_orders_dataframe(history, args.country),
+        "orders_dataframe": app.orders_dataframe(history, args.country),
+    }
+    # Each rerun copies the frame and groups it by restaurant.
+    operations = {
+        "copy": lambda df: df.copy(),
+        "by restaurant": lambda df: df.groupby("restaurant", observed=True)["price"].agg(["sum", "count"]),
+    }
+    rows = []
+    for name, frame in frames.items():
+        timings = [_time_per_body(lambda _: operation(frame), [None], args.repeat) for operation in operations.values()]
+        rows.append([name, f"{frame.memory_usage(deep=True).sum() / 1024 / 1024:,.1f}",
+                     *(f"{elapsed * 1000:,.1f}" for elapsed in timings)])
+    _print_table(rows, ["frame", "MB", *(f"{operation} ms" for operation in operations)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fetch = commands.add_parser("fetch", help="Compare Gmail fetch modes against the local stand-in.")
+    fetch.add_argument("--messages", type=int, default=1000)
+    fetch.add_argument("--country", choices=list(app.COUNTRIES), default="Pakistan")
+    fetch.add_argument("--modes", nargs="+", default=[*app.FETCH_MODES, app.ASYNC_FETCH_MODE],
+                       choices=[*app.FETCH_MODES, app.ASYNC_FETCH_MODE])
+    fetch.add_argument("--latency", type=float, default=0.05, help="Seconds per round trip.")
+    fetch.add_argument("--jitter", type=float, default=0.02, help="Extra random seconds per round trip.")
+    fetch.add_argument("--error-rate", type=float, default=0.0, help="Fraction of messages.get calls that 500.")
+    fetch.add_argument("--quota", type=int, default=0, help="Quota units per second (0 = unlimited).")
+    fetch.add_argument("--workers", type=int, default=app.DEFAULT_FETCH_WORKERS)
+    fetch.add_argument("--list-shards", type=int, default=app.DEFAULT_LIST_SHARDS,
+                       help="Date shards listed in parallel (not used by the async engine).")
+    fetch.add_argument("--concurrency", type=int, default=100, help="Requests in flight for the async engine.")
+    fetch.add_argument("--receipt-ratio", type=float, default=0.75, help="Fraction of emails that are receipts.")
+    fetch.add_argument("--prefilter", action="store_true",
+                       help="Also run each mode with the metadata prefilter pass.")
+    fetch.add_argument("--seed", type=int, default=0)
+    fetch.set_defaults(run=bench_fetch)
+
+    mbox = commands.add_parser("takeout", help="Time the Takeout mbox importer on a generated export.")
+    mbox.add_argument("--messages", type=int, default=1000, help="Foodpanda emails in the export.")
+    mbox.add_argument("--filler", type=int, default=5000, help="Unrelated emails in the export.")
+    mbox.add_argument("--filler-bytes", type=int, default=50_000, help="Attachment size per unrelated email.")
+    mbox.add_argument("--country", choices=list(app.COUNTRIES), default="Pakistan")
+    mbox.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    mbox.add_argument("--seed", type=int, default=0)
+    mbox.set_defaults(run=bench_takeout)
+
+    eml = commands.add_parser("eml", help="Time .eml/Maildir ingestion, on --path or a generated Maildir.")
+    eml.add_argument("--path", help="Directory of .eml files or a Maildir tree (default: generate one).")
+    eml.add_argument("--messages", type=int, default=5000, help="Emails in the generated Maildir.")
+    eml.add_argument("--country", choices=list(app.COUNTRIES), default="Pakistan")
+    eml.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    eml.add_argument("--seed", type=int, default=0)
+    eml.set_defaults(run=bench_eml)
+
+    parse = commands.add_parser("parse", help="Compare receipt parser throughput on synthetic bodies.")
+    parse.add_argument("--messages", type=int, default=20000)
+    parse.add_argument("--country", choices=list(app.COUNTRIES), default="Pakistan")
+    parse.add_argument("--html-only", type=float, default=0.0, help="Fraction of receipts with no text/plain part.")
+    parse.add_argument("--repeat", type=int, default=3, help="Timed passes; the best one is reported.")
+    parse.add_argument("--seed", type=int, default=0)
+    parse.set_defaults(run=bench_parse)
+
+    decode = commands.add_parser("decode", help="Compare full and prefix body decoding on padded receipts.")
+    decode.add_argument("--messages", type=int, default=5000)
+    decode.add_argument("--country", choices=list(app.COUNTRIES), default="Pakistan")
+    decode.add_argument("--html-only", type=float, default=0.0, help="Fraction of receipts with no text/plain part.")
+    decode.add_argument("--footer-lines", type=int, default=1000, help="Boilerplate lines after each receipt.")
+    decode.add_argument("--repeat", type=int, default=3, help="Timed passes; the best one is reported.")
+    decode.add_argument("--seed", type=int, default=0)
+    decode.set_defaults(run=bench_decode)
+
+    html = commands.add_parser("html", help="Time HTML-to-text conversion on HTML-only receipts.")
+    html.add_argument("--messages", type=int, default=5000)
+    html.add_argument("--country", choices=list(app.COUNTRIES), default="Bangladesh")
+    html.add_argument("--footer-lines", type=int, default=20, help="Boilerplate lines after each receipt.")
+    html.add_argument("--repeat", type=int, default=3, help="Timed passes; the best one is reported.")
+    html.add_argument("--seed", type=int, default=0)
+    html.set_defaults(run=bench_html)
+
+    transport = commands.add_parser("transport", help="Compare format=full JSON and format=raw responses.")
+    transport.add_argument("--messages", type=int, default=2000)
+    transport.add_argument("--country", choices=list(app.COUNTRIES), default="Pakistan")
+    transport.add_argument("--html-only", type=float, default=0.0, help="Fraction of receipts with no text/plain part.")
+    transport.add_argument("--footer-lines", type=int, default=20, help="Boilerplate lines after each receipt.")
+    transport.add_argument("--repeat", type=int, default=3, help="Timed passes; the best one is reported.")
+    transport.add_argument("--seed", type=int, default=0)
+    transport.set_defaults(run=bench_transport)
+
+    store = commands.add_parser("store", help="Compare loading the order CSV and the columnar order store.")
+    store.add_argument("--orders", type=int, default=100_000)
+    store.add_argument("--restaurants", type=int, default=50, help="Branches per sample restaurant name.")
+    store.add_argument("--appends", type=int, default=100, help="Saves the store is built up from.")
+    store.add_argument("--country", choices=list(app.COUNTRIES), default="Pakistan")
+    store.add_argument("--repeat", type=int, default=3, help="Timed passes; the best one is reported.")
+    store.add_argument("--seed", type=int, default=0)
+    store.set_defaults(run=bench_store)
+
+    frame = commands.add_parser("frame", help="Compare the compact session order frame with object/float columns.")
+    frame.add_argument("--orders", type=int, default=100_000)
+    frame.add_argument("--restaurants", type=int, default=50, help="Branches per sample restaurant name.")
+    frame.add_argument("--country", choices=list(app.COUNTRIES), default="Pakistan")
+    frame.add_argument("--repeat", type=int, default=5, help="Timed passes; the best one is reported.")
+    frame.add_argument("--seed", type=int, default=0)
+    frame.set_defaults(run=bench_frame)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
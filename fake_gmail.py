@@ -0,0 +1,486 @@
+"""Local stand-in for the parts of the Gmail API the tracker uses.
+
+Serves messages.list / messages.get / getProfile / history.list from a
+synthetic or recorded corpus, either in-process (FakeGmailService, a drop-in
+for a googleapiclient Gmail service, batch requests included) or over HTTP
+(serve(), for the async REST engine). Latency, random errors and a per-second
+quota can be dialled in, so fetch modes can be benchmarked with no network.
+write_mbox and write_maildir render a corpus as an offline export for the
+importers in takeout.
+"""
+import base64
+import email.message
+import email.policy
+import email.utils
+import html
+import json
+import os
+import random
+import re
+import threading
+import time
+import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+RESTAURANTS = [
+    "Kababjees", "Hardee's", "Savour Foods", "Ghousia Nihari", "KFC", "Cheezious",
+    "Student Biryani", "Butlers Chocolate Cafe", "Pizza Hut", "Sultan's Dine",
+]
+
+SENDERS = {
+    "Pakistan": "no-reply@mail.foodpanda.pk",
+    "Bangladesh": "info@mail.foodpanda.com.bd",
+}
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def _receipt_text(country, price, restaurant):
+    if country == "Bangladesh":
+        return (
+            "Your order has been placed\n\n"
+            f"Store {restaurant}\n"
+            "1x Chicken Biryani\n"
+            f"Subtotal Tk {price - 40:,.2f}\n"
+            "Delivery fee Tk 40.00\n"
+            f"Order Total Tk {price:,.2f}\n"
+            "Paid by Cash on Delivery\n"
+        )
+    return (
+        "Thank you for ordering with foodpanda!\n\n"
+        "Partner:\n"
+        f"Name: {restaurant}\n\n"
+        "1x Zinger Burger\n"
+        f"Subtotal PKR {price - 99:,.2f}\n"
+        "Delivery fee PKR 99.00\n"
+        f"Total PKR {price:,.2f}\n"
+        "Paid with Cash\n"
+    )
+
+
+def _promo_text():
+    return "Craving something? Get 50% off your next order this weekend only!\n"
+
+
+def _footer_text(lines):
+    """Legal/unsubscribe boilerplate of about `lines` lines, like the bottom of a real receipt."""
+    line = ("You are receiving this email because you placed an order on foodpanda. "
+            "Prices include applicable taxes. Unsubscribe | Privacy Policy | Terms\n")
+    return line * lines
+
+
+_HTML_HEAD = (
+    "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>foodpanda</title><style>"
+    + "".join(f".c{i}{{font-family:Arial,Helvetica,sans-serif;color:#333;padding:{i}px;line-height:1.4}}"
+              for i in range(40))
+    + "</style></head>"
+)
+_CELL_STYLE = "font-family:Arial,Helvetica,sans-serif;font-size:14px;color:#333333;padding:4px 16px;border:0"
+
+
+def _html_from_text(text):
+    """A layout-table HTML rendering of `text`, markup-heavy like real receipt emails."""
+    rows = "".join(
+        f"<tr><td class=\"c1\" style=\"{_CELL_STYLE}\" align=\"left\" valign=\"top\">"
+        f"<span style=\"{_CELL_STYLE}\">{html.escape(line)}</span></td></tr>\n"
+        for line in text.splitlines()
+    )
+    return (
+        f"{_HTML_HEAD}<body style=\"margin:0;padding:0\">"
+        "<table role=\"presentation\" width=\"100%\" cellpadding=\"0\" cellspacing=\"0\" border=\"0\"><tr><td>"
+        f"<table role=\"presentation\" width=\"600\" cellpadding=\"0\" cellspacing=\"0\" border=\"0\">\n{rows}</table>"
+        "</td></tr></table>"
+        "<img src=\"https://images.foodpanda.com/logo.png\" width=\"120\">"
+        "<img src=\"https://t.foodpanda.com/open.gif?u=0\" width=\"1\" height=\"1\"></body></html>"
+    )
+
+
+def make_message(msg_id, country, sent_at, text, subject, sender=None, html_only=False):
+    """Build a Gmail message resource (format=full) for `text` sent at `sent_at` (aware datetime)."""
+    headers = [
+        {"name": "From", "value": f"foodpanda <{sender or SENDERS[country]}>"},
+        {"name": "To", "value": "user@example.com"},
+        {"name": "Subject", "value": subject},
+        {"name": "Date", "value": email.utils.format_datetime(sent_at)},
+        {"name": "Content-Type", "value": "multipart/alternative; boundary=\"b1\""},
+    ]
+    html_part = {"partId": "1", "mimeType": "text/html", "headers": [], "body": {"data": _b64(_html_from_text(text))}}
+    if html_only:
+        parts = [html_part]
+    else:
+        parts = [{"partId": "0", "mimeType": "text/plain", "headers": [], "body": {"data": _b64(text)}}, html_part]
+    return {
+        "id": msg_id,
+        "threadId": msg_id,
+        "labelIds": ["INBOX", "CATEGORY_UPDATES"],
+        "snippet": text[:100].replace("\n", " "),
+        "internalDate": str(int(sent_at.timestamp() * 1000)),
+        "sizeEstimate": len(text) * 3,
+        "payload": {"partId": "", "mimeType": "multipart/alternative", "headers": headers,
+                    "body": {"size": 0}, "parts": parts},
+    }
+
+
+def synthetic_corpus(n=1000, country="Pakistan", receipt_ratio=0.75, days=365, html_only_ratio=0.0, footer_lines=0,
+                     seed=0):
+    """Generate `n` Foodpanda emails spread over the last `days` days, newest first.
+
+    `footer_lines` pads every body with that much boilerplate after the receipt.
+    """
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    order_subject = "Your order has been placed" if country == "Bangladesh" else "Your foodpanda order"
+    corpus = []
+    for i in range(n):
+        sent_at = now - datetime.timedelta(seconds=rng.uniform(0, days * 86400))
+        if rng.random() < receipt_ratio:
+            price = round(rng.uniform(300, 4000), 2)
+            text = _receipt_text(country, price, rng.choice(RESTAURANTS))
+            subject = order_subject
+        else:
+            text = _promo_text()
+            subject = "Weekend deals are here 🎉"
+        text += _footer_text(footer_lines)
+        corpus.append(make_message(f"{i:016x}", country, sent_at, text, subject,
+                                   html_only=rng.random() < html_only_ratio))
+    corpus.sort(key=lambda m: int(m["internalDate"]), reverse=True)
+    return corpus
+
+
+def raw_message(message):
+    """Render a corpus message resource back into RFC 822 bytes."""
+    mime = email.message.EmailMessage()
+    for header in message["payload"]["headers"]:
+        if header["name"] != "Content-Type":
+            mime[header["name"]] = header["value"]
+    parts = {part["mimeType"]: base64.urlsafe_b64decode(part["body"]["data"]).decode("utf-8")
+             for part in message["payload"].get("parts", [])}
+    if "text/plain" in parts:
+        mime.set_content(parts["text/plain"])
+        if "text/html" in parts:
+            mime.add_alternative(parts["text/html"], subtype="html")
+    else:
+        mime.set_content(parts.get("text/html", ""), subtype="html")
+    return mime.as_bytes(policy=email.policy.SMTP)
+
+
+def write_mbox(corpus, path, filler_messages=0, filler_bytes=50_000, seed=0):
+    """Write `corpus` as a Takeout-style mbox, shuffled in among `filler_messages` unrelated emails.
+
+    Filler messages carry a base64 attachment of about `filler_bytes`, like the
+    newsletters and photos that make up most of a real export.
+    """
+    rng = random.Random(seed)
+    entries = [("MAILER-DAEMON", raw_message(message)) for message in corpus]
+    sent = email.utils.format_datetime(datetime.datetime.now(datetime.timezone.utc))
+    for i in range(filler_messages):
+        # Built by hand: EmailMessage is far too slow for tens of thousands of attachments.
+        attachment = base64.encodebytes(rng.randbytes(filler_bytes))
+        entries.append(("MAILER-DAEMON", (
+            f"From: friend{i % 50}@example.com\nTo: user@example.com\nSubject: Holiday photos {i}\n"
+            f"Date: {sent}\nMIME-Version: 1.0\nContent-Type: multipart/mixed; boundary=\"f{i}\"\n\n"
+            f"--f{i}\nContent-Type: text/plain; charset=\"utf-8\"\n\n"
+            "From the trip, see attached.\nFrom here on it only gets better.\n\n"
+            f"--f{i}\nContent-Type: image/jpeg\nContent-Transfer-Encoding: base64\n"
+            f"Content-Disposition: attachment; filename=\"{i}.jpg\"\n\n"
+        ).encode("ascii") + attachment + f"\n--f{i}--\n".encode("ascii")))
+    rng.shuffle(entries)
+    with open(path, "wb") as f:
+        for envelope, raw in entries:
+            raw = raw.replace(b"\r\n", b"\n")
+            raw = re.sub(rb"^(>*From )", rb">\1", raw, flags=re.MULTILINE)
+            f.write(b"From " + envelope.encode("ascii") + b" Thu Jan  1 00:00:00 2026\n" + raw.rstrip(b"\n") + b"\n\n")
+
+
+def write_maildir(corpus, path):
+    """Write `corpus` as a Maildir tree (one file per message in cur/)."""
+    for sub in ("cur", "new", "tmp"):
+        os.makedirs(os.path.join(path, sub), exist_ok=True)
+    for message in corpus:
+        with open(os.path.join(path, "cur", f"{message['internalDate']}.{message['id']}:2,S"), "wb") as f:
+            f.write(raw_message(message))
+
+
+def save_corpus(corpus, path):
+    """Write a corpus as JSON lines, one message resource per line."""
+    with open(path, "w", encoding="utf-8") as f:
+        for message in corpus:
+            f.write(json.dumps(message) + "\n")
+
+
+def load_corpus(path):
+    """Read a corpus written by save_corpus or record_corpus."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def record_corpus(service, query, path, max_results=None):
+    """Record real messages matching `query` from a Gmail service into a replayable corpus file."""
+    corpus = []
+    page_token = None
+    while max_results is None or len(corpus) < max_results:
+        page = service.users().messages().list(userId="me", q=query, maxResults=500, pageToken=page_token).execute()
+        for stub in page.get("messages", []):
+            corpus.append(service.users().messages().get(userId="me", id=stub["id"]).execute())
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            break
+    save_corpus(corpus[:max_results], path)
+    return len(corpus)
+
+
+class FakeGmailError(Exception):
+    def __init__(self, status, reason):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+        self.reason = reason
+
+    def body(self):
+        return json.dumps({"error": {"code": self.status, "message": self.reason,
+                                     "errors": [{"reason": self.reason}]}}).encode("utf-8")
+
+    def as_http_error(self):
+        return HttpError(httplib2.Response({"status": self.status}), self.body())
+
+
+class FakeGmailBackend:
+    """The mailbox: a corpus plus the latency, error and quota behaviour of the API.
+
+    `latency` (seconds, plus up to `jitter` more) is charged per HTTP round trip.
+    `error_rate` makes messages.get fail with a 500. `quota_per_second` throttles
+    with 429 rateLimitExceeded once more quota units are spent in a second than
+    allowed, the way Gmail's per-user limit does.
+    """
+
+    QUOTA_UNITS = {"messages.list": 5, "messages.get": 5, "history.list": 2, "getProfile": 1}
+
+    def __init__(self, corpus, latency=0.0, jitter=0.0, error_rate=0.0, quota_per_second=None, seed=0):
+        self.messages = list(corpus)
+        self.by_id = {m["id"]: m for m in self.messages}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota_per_second = quota_per_second
+        self.calls = {name: 0 for name in self.QUOTA_UNITS}
+        self.throttled = 0
+        self.history = [(i + 1, m["id"]) for i, m in enumerate(reversed(self.messages))]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_units = 0
+
+    @property
+    def history_id(self):
+        return len(self.history)
+
+    def add_message(self, message):
+        """Deliver a new message, as history.list will later report it."""
+        with self._lock:
+            self.messages.insert(0, message)
+            self.by_id[message["id"]] = message
+            self.history.append((len(self.history) + 1, message["id"]))
+
+    def round_trip(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._rng.uniform(0, self.jitter))
+
+    def charge(self, method):
+        with self._lock:
+            self.calls[method] += 1
+            if self.quota_per_second is None:
+                return
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start, self._window_units = now, 0
+            self._window_units += self.QUOTA_UNITS[method]
+            if self._window_units > self.quota_per_second:
+                self.throttled += 1
+                raise FakeGmailError(429, "rateLimitExceeded")
+
+    def list_messages(self, q="", maxResults=100, pageToken=None, **_):
+        self.charge("messages.list")
+        after = re.search(r"after:(\d+)", q or "")
+        before = re.search(r"before:(\d+)", q or "")
+        matching = [
+            m for m in self.messages
+            if (not after or int(m["internalDate"]) // 1000 > int(after.group(1)))
+            and (not before or int(m["internalDate"]) // 1000 < int(before.group(1)))
+        ]
+        start = int(pageToken or 0)
+        end = start + min(int(maxResults), 500)
+        page = {"messages": [{"id": m["id"], "threadId": m["threadId"]} for m in matching[start:end]],
+                "resultSizeEstimate": len(matching)}
+        if not page["messages"]:
+            del page["messages"]
+        if end < len(matching):
+            page["nextPageToken"] = str(end)
+        return page
+
+    def get_message(self, id, format="full", metadataHeaders=None, **_):
+        self.charge("messages.get")
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+        if failed:
+            raise FakeGmailError(500, "backendError")
+        if id not in self.by_id:
+            raise FakeGmailError(404, "notFound")
+        message = self.by_id[id]
+        if format == "metadata":
+            payload = {k: v for k, v in message["payload"].items() if k != "parts"}
+            if metadataHeaders:
+                wanted = {name.lower() for name in metadataHeaders}
+                payload["headers"] = [h for h in payload["headers"] if h["name"].lower() in wanted]
+            message = {**message, "payload": payload}
+        elif format == "raw":
+            message = {**{k: v for k, v in message.items() if k != "payload"},
+                       "raw": base64.urlsafe_b64encode(raw_message(message)).decode("ascii")}
+        return message
+
+    def get_profile(self):
+        self.charge("getProfile")
+        return {"emailAddress": "user@example.com", "messagesTotal": len(self.messages),
+                "historyId": str(self.history_id)}
+
+    def list_history(self, startHistoryId, pageToken=None, **_):
+        self.charge("history.list")
+        start = int(startHistoryId)
+        added = [{"id": str(hid), "messagesAdded": [{"message": {"id": mid, "threadId": mid}}]}
+                 for hid, mid in self.history if hid > start]
+        return {"history": added, "historyId": str(self.history_id)}
+
+
+class _FakeRequest:
+    def __init__(self, backend, call):
+        self.backend = backend
+        self.call = call
+        self.headers = {}
+
+    def execute(self, *args, **kwargs):
+        self.backend.round_trip()
+        return self.run()
+
+    def run(self):
+        try:
+            return self.call()
+        except FakeGmailError as e:
+            raise e.as_http_error()
+
+
+class _FakeBatch:
+    def __init__(self, backend, callback):
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if len(self.requests) >= 1000:
+            raise ValueError("Too many requests in one batch")
+        self.requests.append((request_id or str(len(self.requests)), request, callback))
+
+    def execute(self, *args, **kwargs):
+        # One round trip for the whole batch: that's the point of batching.
+        self.backend.round_trip()
+        if len(self.requests) > 100:
+            raise FakeGmailError(400, "tooManyRequestsInBatch").as_http_error()
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = request.run(), None
+            except HttpError as e:
+                response, exception = None, e
+            (callback or self.callback)(request_id, response, exception)
+
+
+class _Namespace:
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+
+class FakeGmailService:
+    """In-process replacement for googleapiclient's Gmail service object."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _request(self, call):
+        return _FakeRequest(self.backend, call)
+
+    def users(self):
+        backend = self.backend
+        messages = _Namespace(
+            list=lambda userId="me", **kw: self._request(lambda: backend.list_messages(**kw)),
+            get=lambda userId="me", id=None, **kw: self._request(lambda: backend.get_message(id, **kw)),
+        )
+        history = _Namespace(
+            list=lambda userId="me", **kw: self._request(lambda: backend.list_history(**kw)),
+        )
+        return _Namespace(
+            messages=lambda: messages,
+            history=lambda: history,
+            getProfile=lambda userId="me": self._request(backend.get_profile),
+        )
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self.backend, callback)
+
+
+def _handler_for(backend):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out as separate writes; with Nagle on, keep-alive
+        # clients stall ~40 ms per request on delayed ACKs.
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            path = url.path.rstrip("/").split("/users/me", 1)[-1]
+            backend.round_trip()
+            try:
+                if path == "/profile":
+                    result = backend.get_profile()
+                elif path == "/history":
+                    result = backend.list_history(**params)
+                elif path == "/messages":
+                    result = backend.list_messages(**params)
+                elif path.startswith("/messages/"):
+                    result = backend.get_message(path.rsplit("/", 1)[1], **params)
+                else:
+                    raise FakeGmailError(404, "notFound")
+                status, body = 200, json.dumps(result).encode("utf-8")
+            except FakeGmailError as e:
+                status, body = e.status, e.body()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+class _FakeGmailHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connects when the async engine opens
+    # a hundred connections at once.
+    request_queue_size = 1024
+
+
+def serve(backend, host="127.0.0.1", port=0):
+    """Serve `backend` over HTTP on a background thread.
+
+    Returns (server, api_root); pass api_root to get_emails_async and call
+    server.shutdown() when done.
+    """
+    server = _FakeGmailHTTPServer((host, port), _handler_for(backend))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_root = f"http://{server.server_address[0]}:{server.server_address[1]}/gmail/v1/users/me"
+    return server, api_root
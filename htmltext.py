@@ -0,0 +1,56 @@
+"""Turn HTML email bodies into the line-oriented text the receipt parsers expect.
+
+Receipts with no text/plain part are mostly markup: styles, tracking images
+and nested layout tables around a few dozen lines of text. html_to_text makes
+one regex pass over the markup that drops scripts, styles and comments, turns
+block and row boundaries into line breaks and table cells into spaces; the
+whitespace tidying and entity unescaping that follow only see the much smaller
+text that is left.
+
+Kept free of Streamlit so takeout's worker processes can import it.
+"""
+import html
+import re
+
+_BLOCK_TAGS = ("address", "article", "blockquote", "br", "center", "dd", "div", "dl", "dt", "footer", "h1", "h2",
+               "h3", "h4", "h5", "h6", "header", "hr", "li", "ol", "p", "pre", "section", "table", "tbody", "tfoot",
+               "thead", "title", "tr", "ul")
+_CELL_TAGS = ("td", "th")
+# Stands in for a line break until source whitespace has been collapsed.
+_BREAK = "\x00"
+_REPLACEMENTS = {**{tag: _BREAK for tag in _BLOCK_TAGS}, **{tag: " " for tag in _CELL_TAGS}}
+
+# Comments, whole script/style/head elements, or a single tag. Each alternative
+# also accepts running off the end of the input, so a truncated prefix (see
+# app.BODY_PREFIX_BYTES) doesn't leak half a tag into the text.
+_TOKEN = re.compile(
+    r"<!--.*?(?:-->|\Z)"
+    r"|<(script|style|head)\b.*?(?:</\1\s*>|\Z)"
+    r"|</?([a-zA-Z][a-zA-Z0-9]*)[^>]*(?:>|\Z)"
+    r"|<![^>]*(?:>|\Z)",
+    re.IGNORECASE | re.DOTALL,
+)
+# Markup rather than text that happens to contain "<": a tag or doctype near the start.
+_LOOKS_LIKE_HTML = re.compile(r"\s*(?:<!doctype|<html|<head|<body|<table|<div|<!--)", re.IGNORECASE)
+
+
+def looks_like_html(text):
+    """True if `text` starts like an HTML document or fragment."""
+    return _LOOKS_LIKE_HTML.match(text) is not None
+
+
+def html_to_text(markup):
+    """Visible text of `markup`, one line per block or table row, cells separated by spaces."""
+    if "<" not in markup:
+        return markup
+    # split() leaves [text, element, tag name, text, ...]; mapping the names in a
+    # list comprehension is much cheaper than a re.sub callback per tag.
+    pieces = _TOKEN.split(markup)
+    pieces[1::3] = [""] * (len(pieces) // 3)
+    pieces[2::3] = [_REPLACEMENTS.get(name.lower(), "") if name else "" for name in pieces[2::3]]
+    text = "".join(pieces)
+    if "&" in text:
+        text = html.unescape(text)
+    # Source line breaks are just whitespace in HTML; only tags make new lines.
+    lines = (" ".join(line.split()) for line in text.split(_BREAK))
+    return "\n".join(line for line in lines if line)
@@ -0,0 +1,47 @@
+"""Import a foodpanda_orders.csv file into the order database for one mailbox.
+
+The CSV carries no account, so the app never imports it on its own: the
+operator names the Gmail address and country it belongs to. Importing app
+executes the Streamlit script in bare mode, so the same
+.streamlit/secrets.toml the app uses must be present.
+
+    python migrate_orders.py --email you@example.com --country Pakistan
+    python migrate_orders.py --email you@example.com --csv old_orders.csv --db orders.sqlite
+"""
+import argparse
+import os
+import warnings
+
+import streamlit.logger
+
+# Bare-mode Streamlit warns on every widget call; keep the output readable.
+streamlit.logger.set_log_level("error")
+warnings.filterwarnings("ignore", category=UserWarning)
+
+import app  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--email", required=True, help="Gmail address the orders in the CSV were fetched from")
+    parser.add_argument("--country", choices=list(app.COUNTRIES), default="Pakistan")
+    parser.add_argument("--csv", default="foodpanda_orders.csv")
+    parser.add_argument("--db", default=os.environ.get("FOODPANDA_ORDER_DB_PATH"),
+                        help="order database file (default: $FOODPANDA_ORDER_DB_PATH)")
+    args = parser.parse_args()
+    if not args.db:
+        parser.error("--db is required when FOODPANDA_ORDER_DB_PATH is not set")
+    if not os.path.exists(args.csv):
+        parser.error(f"{args.csv} does not exist")
+
+    order_db = app.OrderDatabase(args.db)
+    account = app._account_key({"emailAddress": args.email})
+    if order_db.has_csv_orders(account, args.country):
+        print(f"Nothing imported: a CSV was already imported for this mailbox in {args.country}")
+        return
+    imported = app.migrate_csv_to_database(order_db, account, args.country, args.csv)
+    print(f"Imported {imported} orders from {args.csv} (rows matching orders fetched from Gmail are skipped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Read Foodpanda order emails out of offline mail exports.
+
+For users who would rather not grant Gmail access: Takeout's "Mail" export is a
+single mbox file that can run to many gigabytes. The file is memory-mapped and
+split into byte ranges on "From " separator lines; each range is scanned by a
+worker process, which only hands the stdlib email parser the messages whose
+header block mentions a wanted sender. Directories of .eml files and Maildir
+trees are read the same way, a group of files per task. Workers return
+(date, body) pairs for order emails; turning those into orders is left to
+app.parse_order_email.
+
+Kept free of Streamlit so worker processes can import it.
+"""
+import email.header
+import mmap
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from email import policy
+from email.parser import BytesParser
+
+import htmltext
+
+# Ranges smaller than this aren't worth shipping to another process.
+MIN_CHUNK_BYTES = 32 * 1024 * 1024
+# Extra ranges per worker so one slow range doesn't leave the others idle.
+CHUNKS_PER_WORKER = 4
+# Message files handed to a worker at a time when reading .eml directories.
+FILES_PER_TASK = 256
+# Workers are spawned, not forked: the Streamlit server process is full of
+# threads. Single-threaded callers can switch to "fork" for faster startup.
+WORKER_START_METHOD = "spawn"
+
+_SEPARATOR = b"\nFrom "
+# mboxrd escapes body lines starting with "From " as ">From ".
+_ESCAPED_FROM = re.compile(r"^>(>*From )", re.MULTILINE)
+
+
+def _range_start(mm, position):
+    """First message boundary at or after `position`."""
+    if position == 0:
+        return 0
+    found = mm.find(_SEPARATOR, position - 1)
+    return len(mm) if found == -1 else found + 1
+
+
+def _iter_messages(mm, start, end):
+    """Yield (start, stop) offsets of every message whose "From " line starts in [start, end)."""
+    position = _range_start(mm, start)
+    end = min(end, len(mm))
+    while position < end:
+        following = mm.find(_SEPARATOR, position)
+        stop = len(mm) if following == -1 else following + 1
+        yield position, stop
+        position = stop
+
+
+def _header_end(mm, start, stop):
+    """Offset where the header block of the message in [start, stop) ends."""
+    end = mm.find(b"\n\n", start, stop)
+    end = stop if end == -1 else end
+    # A CRLF blank line can only come first if it ends before the LF one.
+    crlf = mm.find(b"\r\n\r\n", start, end)
+    return end if crlf == -1 else crlf
+
+
+def _text_body(message, mboxrd=True):
+    """Equivalent of app._extract_text_body for a parsed email.message.Message.
+
+    `mboxrd` undoes the ">From " escaping mbox files add to body lines.
+    """
+    plain = html = None
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if content_type == "text/plain" and plain is None:
+            plain = part
+        elif content_type == "text/html" and html is None:
+            html = part
+    chosen = plain or html
+    if chosen is None:
+        return ""
+    payload = chosen.get_payload(decode=True) or b""
+    try:
+        text = payload.decode(chosen.get_content_charset() or "utf-8", errors="replace")
+    except LookupError:
+        text = payload.decode("utf-8", errors="replace")
+    if mboxrd:
+        text = _ESCAPED_FROM.sub(r"\1", text)
+    return htmltext.html_to_text(text) if chosen is html else text
+
+
+def _header(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return ""
+    try:
+        return str(email.header.make_header(email.header.decode_header(value)))
+    except Exception:
+        return str(value)
+
+
+def message_date_and_body(raw):
+    """(Date header, text body) of a single RFC 822 message given as bytes, e.g. Gmail's format=raw."""
+    message = BytesParser(policy=policy.compat32).parsebytes(raw)
+    return _header(message, "Date") or "No Date", _text_body(message, mboxrd=False)
+
+
+def _is_order_message(headers, senders, order_subject):
+    """Mirrors app._is_order_email on a parsed header block."""
+    sender = _header(headers, "From").lower()
+    if any(address in sender for address in senders):
+        return True
+    return bool(order_subject) and order_subject in _header(headers, "Subject")
+
+
+class _OrderFilter:
+    """Picks order emails out of raw messages, parsing as little as possible.
+
+    `senders` are lowercase addresses. Messages whose raw header block contains
+    neither a sender nor `order_subject` are skipped without being parsed, which
+    is what keeps a multi-gigabyte export fast: receipts are a tiny fraction of it.
+    """
+
+    def __init__(self, senders, order_subject=None):
+        self.senders = senders
+        self.order_subject = order_subject
+        self.needles = [address.encode("utf-8") for address in senders]
+        if order_subject:
+            self.needles.append(order_subject.lower().encode("utf-8"))
+        # compat32 parses several times faster than policy.default, and we only
+        # need raw header strings and decoded text parts.
+        self.parser = BytesParser(policy=policy.compat32)
+
+    def extract(self, header_block, load_message):
+        """(date, body) if the message is an order email, else None; `load_message()` returns its bytes."""
+        if not any(needle in header_block.lower() for needle in self.needles):
+            return None
+        headers = self.parser.parsebytes(header_block, headersonly=True)
+        if not _is_order_message(headers, self.senders, self.order_subject):
+            return None
+        message = self.parser.parsebytes(load_message())
+        return _header(message, "Date") or "No Date", _text_body(message)
+
+
+def scan_range(path, start, end, senders, order_subject=None):
+    """Return [(date, body)] for the order emails in one byte range of the mbox at `path`."""
+    order_filter = _OrderFilter(senders, order_subject)
+    found = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for message_start, message_stop in _iter_messages(mm, start, end):
+            # Skip the "From sender date" envelope line; it isn't part of the message.
+            message_start = mm.find(b"\n", message_start, message_stop) + 1 or message_stop
+            # Only the header block is copied out of the map for messages we don't want.
+            header_block = mm[message_start:_header_end(mm, message_start, message_stop)]
+            order_email = order_filter.extract(header_block, lambda: mm[message_start:message_stop])
+            if order_email:
+                found.append(order_email)
+    return found
+
+
+def scan_files(paths, senders, order_subject=None):
+    """Return [(date, body)] for the order emails among the single-message files at `paths`."""
+    order_filter = _OrderFilter(senders, order_subject)
+    found = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except OSError:
+            # Maildir deliveries can be moved or deleted while we walk the tree.
+            continue
+        order_email = order_filter.extract(raw[:_header_end(raw, 0, len(raw))], lambda: raw)
+        if order_email:
+            found.append(order_email)
+    return found
+
+
+def byte_ranges(size, chunks):
+    """Split [0, size) into `chunks` roughly equal (start, end) ranges."""
+    bounds = [size * i // chunks for i in range(chunks + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(chunks) if bounds[i] < bounds[i + 1]]
+
+
+def _run_scans(scan, tasks, workers, on_chunk=None):
+    """Run `scan(*task)` for every task, across a process pool when there's more than one."""
+    results = []
+    if len(tasks) == 1 or workers == 1:
+        for done, task in enumerate(tasks, 1):
+            results.extend(scan(*task))
+            if on_chunk:
+                on_chunk(done, len(tasks))
+        return results
+    context = multiprocessing.get_context(WORKER_START_METHOD)
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=context) as pool:
+        futures = [pool.submit(scan, *task) for task in tasks]
+        # Collected in submission order, so emails come out in input order.
+        for done, future in enumerate(futures, 1):
+            results.extend(future.result())
+            if on_chunk:
+                on_chunk(done, len(tasks))
+    return results
+
+
+def read_order_emails(path, senders, order_subject=None, workers=None, on_chunk=None):
+    """Return [(date, body)] for every order email in the mbox at `path`, in file order.
+
+    Byte ranges are scanned by a pool of `workers` processes (CPU count by
+    default); files under MIN_CHUNK_BYTES are scanned in this process.
+    `on_chunk(done, total)` is called as ranges finish.
+    """
+    senders = [address.lower() for address in senders]
+    size = os.path.getsize(path)
+    if not size:
+        return []
+    workers = workers or os.cpu_count() or 1
+    chunks = max(1, min(size // MIN_CHUNK_BYTES, workers * CHUNKS_PER_WORKER))
+    tasks = [(path, start, end, senders, order_subject) for start, end in byte_ranges(size, chunks)]
+    return _run_scans(scan_range, tasks, workers, on_chunk)
+
+
+def iter_message_files(root):
+    """Yield the message files under `root`: *.eml anywhere, plus Maildir cur/ and new/ entries."""
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        # Maildir's tmp/ holds deliveries still being written.
+        if "tmp" in subdirectories and {"cur", "new"} & set(subdirectories):
+            subdirectories.remove("tmp")
+        in_maildir = os.path.basename(directory) in ("cur", "new")
+        for name in sorted(files):
+            if in_maildir or name.lower().endswith(".eml"):
+                yield os.path.join(directory, name)
+
+
+def read_order_emails_from_directory(root, senders, order_subject=None, workers=None, on_chunk=None):
+    """Return [(date, body)] for every order email in a directory of .eml files or a Maildir tree.
+
+    Files are handed to a pool of `workers` processes in groups of FILES_PER_TASK,
+    in sorted path order; `on_chunk(done, total)` is called as groups finish.
+    """
+    senders = [address.lower() for address in senders]
+    paths = list(iter_message_files(root))
+    if not paths:
+        return []
+    workers = workers or os.cpu_count() or 1
+    tasks = [(paths[i:i + FILES_PER_TASK], senders, order_subject) for i in range(0, len(paths), FILES_PER_TASK)]
+    return _run_scans(scan_files, tasks, workers, on_chunk)